@@ -3,7 +3,9 @@ from PyInstaller.utils.hooks import collect_all
 
 datas = [('config', 'config'), ('templates', 'templates')]
 binaries = []
-hiddenimports = ['flask_cors', 'gspread', 'google.oauth2.service_account', 'pymysql', 'sqlalchemy', 'flask_sqlalchemy', 'dotenv']
+# gspread、google-auth 與 pymysql 在程式中延遲匯入，明確列出以確保被打包
+lazy_imports = ['gspread', 'google.oauth2.credentials', 'google.auth.transport.requests', 'google_auth_oauthlib.flow', 'pymysql']
+hiddenimports = ['flask_cors', 'google.oauth2.service_account', 'sqlalchemy', 'flask_sqlalchemy', 'dotenv'] + lazy_imports
 tmp_ret = collect_all('flask')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
 tmp_ret = collect_all('gspread')
@@ -47,3 +49,49 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+# 命令列同步（sync_cli.py）：不收集 Flask 的範本與 CORS 等網頁伺服器資源；
+# 以資料夾形式輸出（dist/activeRewardSync/），每次執行不需要先解壓縮，啟動較單一檔案快
+# 執行時讀取 exe 所在資料夾中的 config 目錄
+cli_a = Analysis(
+    ['sync_cli.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=lazy_imports + ['sqlalchemy', 'flask_sqlalchemy', 'dotenv'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['flask_cors', 'tkinter'],
+    noarchive=False,
+    optimize=0,
+)
+cli_pyz = PYZ(cli_a.pure)
+
+cli_exe = EXE(
+    cli_pyz,
+    cli_a.scripts,
+    [],
+    exclude_binaries=True,
+    name='activeRewardSync',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+cli_coll = COLLECT(
+    cli_exe,
+    cli_a.binaries,
+    cli_a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='activeRewardSync',
+)
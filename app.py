@@ -1,11 +1,18 @@
-from flask import Flask, render_template, jsonify, request, redirect, session, url_for
-from config import Config
+from flask import Flask, Response, render_template, jsonify, request, redirect, session, url_for, stream_with_context
+from config import get_config, config_stats
 from models import db, ActiveReward
-from sync_service import SyncService
+from job_service import SyncJobManager
+from schedule_service import SyncScheduler
+from status_service import reward_counts
+from migrations import ensure_schema
 from sheets_service import GoogleSheetsService, SCOPES
+from rate_limiter import sheets_limiter
+from metrics import registry
 import logging
 from flask_cors import CORS
 import os
+import json
+from datetime import datetime
 from pathlib import Path
 
 # 設定日誌
@@ -15,7 +22,7 @@ logging.basicConfig(
 )
 
 app = Flask(__name__)
-app.config.from_object(Config())
+app.config.from_object(get_config())
 # 設定 secret_key 用於 session（OAuth 流程需要）
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
@@ -25,6 +32,68 @@ allowed_origins = os.getenv('ALLOWED_ORIGINS', '*').split(',')
 CORS(app, resources={r"/api/*": {"origins": allowed_origins}})
 db.init_app(app)
 
+def init_database():
+    """
+    確認資料庫存在、建立資料表並套用尚未執行的遷移（DB_AVAILABLE 記錄結果）
+    以 WSGI 伺服器（gunicorn 等）匯入 app 時在匯入時執行，直接執行 app.py 時在 __main__ 區塊執行；
+    多個程序同時啟動時由 run_migrations 的 MySQL 具名鎖確保只有一個程序執行遷移
+    """
+    # 預設 DB 可用性為 False，啟動時檢查後再更新
+    app.config['DB_AVAILABLE'] = False
+    
+    with app.app_context():
+        try:
+            # 如果使用 MySQL，嘗試在伺服器上建立資料庫（如果不存在）
+            db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+            if db_uri and db_uri.startswith('mysql'):
+                try:
+                    import pymysql
+                    
+                    host = app.config.get('DB_HOST', 'localhost')
+                    port = int(app.config.get('DB_PORT', 3306))
+                    user = app.config.get('DB_USER', 'root')
+                    password = app.config.get('DB_PASSWORD', '')
+                    db_name = app.config.get('DB_NAME', '')
+                    charset = app.config.get('DB_CHARSET', 'utf8mb4')
+                    
+                    conn = pymysql.connect(host=host, port=port, user=user, password=password, charset=charset)
+                    with conn.cursor() as cur:
+                        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET {charset}")
+                    conn.commit()
+                    conn.close()
+                    logging.info(f"確保資料庫存在: {db_name}")
+                except Exception as e:
+                    logging.error(f"無法建立或連線到 MySQL 伺服器: {e}")
+            
+            # 嘗試建立資料表（如果連線失敗會拋出例外）
+            try:
+                # 既有資料表不會被 create_all 修改，新增的欄位與索引以遷移套用
+                ensure_schema(db.engine)
+                app.config['DB_AVAILABLE'] = True
+                logging.info('資料表建立檢查完成，DB 可用')
+            except Exception as e:
+                app.config['DB_AVAILABLE'] = False
+                logging.error(f'建立資料表失敗，DB 可能不可用: {e}')
+        
+        except Exception as e:
+            app.config['DB_AVAILABLE'] = False
+            logging.error(f"啟動時檢查資料庫發生未預期錯誤: {e}")
+
+# 背景同步工作（程序內執行緒池）
+sync_jobs = SyncJobManager(app, max_workers=app.config.get('SYNC_WORKERS', 2))
+
+# 排程同步（SYNC_SCHEDULE=true 時定期執行），在資料庫遷移完成後才啟動（遷移尚未全部套用時排程也不會執行同步）
+# 多個 worker 程序時以 MySQL 具名鎖選出單一程序執行排程（見 SyncScheduler），SQLite 只支援單一程序
+sync_scheduler = SyncScheduler(sync_jobs)
+
+# 以 WSGI 伺服器（gunicorn 等）匯入時在此初始化資料庫並啟動排程；直接執行時在 __main__ 區塊進行
+if __name__ != '__main__':
+    init_database()
+    sync_scheduler.start()
+
+# /api/status 的筆數快取
+reward_counts.ttl = app.config.get('STATUS_CACHE_TTL', 30)
+
 @app.route('/')
 def index():
     """首頁"""
@@ -32,11 +101,17 @@ def index():
 
 @app.route('/api/sync', methods=['POST'])
 def sync():
-    """同步資料 API"""
+    """建立背景同步工作 API，立即回傳 job_id"""
     try:
-        sync_service = SyncService()
-        result = sync_service.sync_data()
-        return jsonify(result)
+        job = sync_jobs.submit()
+        joined = job.get('joined', False)
+        return jsonify({
+            'success': True,
+            'message': '同一工作表的同步正在執行，已加入該工作' if joined else '同步工作已建立',
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'joined': joined
+        }), 202
     except Exception as e:
         # 記錄完整 traceback 以供除錯
         import traceback
@@ -50,17 +125,61 @@ def sync():
             'count': 0
         }), 500
 
+@app.route('/api/sync/<job_id>', methods=['GET'])
+def sync_job_status(job_id):
+    """查詢同步工作進度"""
+    job = sync_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': f'找不到同步工作: {job_id}'
+        }), 404
+    job['success'] = True
+    return jsonify(job)
+
+@app.route('/api/schedule', methods=['GET'])
+def schedule():
+    """查詢排程同步狀態（目前間隔、下一次執行時間、最近一次結果）"""
+    return jsonify(dict(sync_scheduler.stats(), success=True))
+
+@app.route('/api/schedule/run', methods=['POST'])
+def schedule_run():
+    """立即執行下一次排程同步"""
+    if not get_config().SYNC_SCHEDULE:
+        return jsonify({
+            'success': False,
+            'message': '排程同步未啟用（SYNC_SCHEDULE）'
+        }), 409
+    sync_scheduler.run_now()
+    return jsonify(dict(sync_scheduler.stats(), success=True)), 202
+
 @app.route('/api/status', methods=['GET'])
 def status():
-    """取得系統狀態"""
+    """
+    取得系統狀態
+    筆數由快取提供（過期時先回傳舊值並在背景重新計算），不會每次查詢都執行 COUNT(*)；
+    資料庫連線狀態則每次以 SELECT 1 確認（快取的筆數不代表資料庫目前可連線）
+    可用 ?breakdown=state,round 取得依狀態、執行代號的統計
+    """
     try:
         # 測試資料庫連接
-        count = ActiveReward.query.count()
-        return jsonify({
+        db.session.execute(db.text("SELECT 1"))
+        total = reward_counts.get('total')
+        response = {
             'success': True,
             'database_connected': True,
-            'total_records': count
-        })
+            'total_records': total['value'],
+            'cache_age': total['age'],
+            'stale': total['stale']
+        }
+        for name in request.args.get('breakdown', '').split(','):
+            name = name.strip()
+            if name in ('state', 'round'):
+                response[f'by_{name}'] = reward_counts.get(name)['value']
+        response['db_pool'] = _pool_status()
+        response['config'] = config_stats()
+        response['sheets_api'] = sheets_limiter.stats()
+        return jsonify(response)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -68,6 +187,93 @@ def status():
             'error': str(e)
         }), 500
 
+def _pool_status():
+    """資料庫連線池使用狀況（不需要連線資料庫）"""
+    pool = db.engine.pool
+    status = {'class': type(pool).__name__, 'status': pool.status()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+def _runtime_metrics():
+    """輸出 /metrics 時才計算的指標：資料庫連線池與 Sheets API 速率限制狀態"""
+    pool = _pool_status()
+    pool_samples = [({'state': name}, pool[name]) for name in ('size', 'checkedin', 'checkedout', 'overflow') if name in pool]
+    limiter = sheets_limiter.stats()
+    return [
+        ('db_pool_connections', '資料庫連線池狀態（size 大小、checkedin 閒置、checkedout 使用中、overflow 溢出）', 'gauge', pool_samples),
+        ('sheets_api_throttled_total', 'Sheets API 回傳 429 的次數', 'counter',
+         [({'kind': kind}, stats['throttled']) for kind, stats in limiter.items()]),
+        ('sheets_api_wait_seconds_total', '等待速率限制與退避的累計秒數', 'counter',
+         [({'kind': kind}, round(stats['wait_seconds'] + stats['backoff_seconds'], 3)) for kind, stats in limiter.items()]),
+        ('sheets_api_rate_per_minute', '目前的 Sheets API 請求速率上限（被限速時自動調降）', 'gauge',
+         [({'kind': kind}, stats['rate_per_minute']) for kind, stats in limiter.items()]),
+    ]
+
+registry.add_collector(_runtime_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文字格式的監控指標（同步各階段時間、Sheets API 呼叫、連線池）"""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/rewards', methods=['GET'])
+def rewards():
+    """
+    查詢發放紀錄（keyset 分頁，依 id 由新到舊）
+    篩選參數：round、char_id、char_name、item_id、state、end_time_from、end_time_to（ISO 8601）
+    分頁參數：limit、cursor（上一頁回傳的 next_cursor）
+    回應以串流方式輸出 JSON，不會一次把整頁結果載入記憶體
+    """
+    try:
+        query = _reward_query(request.args)
+        limit = min(
+            int(request.args.get('limit', app.config.get('REWARDS_PAGE_SIZE', 100))),
+            app.config.get('REWARDS_MAX_PAGE_SIZE', 1000)
+        )
+        if limit <= 0:
+            raise ValueError('limit 必須大於 0')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'查詢參數錯誤: {str(e)}'
+        }), 400
+    
+    def generate():
+        yield '{"success": true, "items": ['
+        count = 0
+        last_id = None
+        page_query = query.order_by(ActiveReward.id.desc()).limit(limit)
+        if app.config.get('DB_SERVER_SIDE_CURSORS', True):
+            # 伺服器端游標：逐批取回資料列
+            page_query = page_query.yield_per(200)
+        for reward in page_query:
+            yield (',' if count else '') + json.dumps(reward.to_dict(), ensure_ascii=False)
+            count += 1
+            last_id = reward.id
+        next_cursor = last_id if count == limit else None
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def _reward_query(args):
+    """依查詢參數建立 active_reward 查詢（參數格式錯誤時拋出 ValueError）"""
+    query = ActiveReward.query
+    for name in ('char_id', 'char_name', 'item_id'):
+        if args.get(name):
+            query = query.filter(getattr(ActiveReward, name) == args[name])
+    for name in ('round', 'state'):
+        if args.get(name):
+            query = query.filter(getattr(ActiveReward, name) == int(args[name]))
+    if args.get('end_time_from'):
+        query = query.filter(ActiveReward.end_time >= datetime.fromisoformat(args['end_time_from']))
+    if args.get('end_time_to'):
+        query = query.filter(ActiveReward.end_time < datetime.fromisoformat(args['end_time_to']))
+    if args.get('cursor'):
+        query = query.filter(ActiveReward.id < int(args['cursor']))
+    return query
+
 @app.route('/api/oauth/authorize', methods=['GET'])
 def oauth_authorize():
     """
@@ -75,7 +281,7 @@ def oauth_authorize():
     用於 Render 等 Web 環境
     """
     try:
-        config = Config()
+        config = get_config()
         client_secrets_file = Path(config.GOOGLE_SHEETS_CREDENTIALS_FILE)
         
         if not client_secrets_file.exists():
@@ -119,7 +325,7 @@ def oauth2callback():
     處理 Google 重定向回來的授權結果
     """
     try:
-        config = Config()
+        config = get_config()
         client_secrets_file = Path(config.GOOGLE_SHEETS_CREDENTIALS_FILE)
         token_file = Path(config.GOOGLE_SHEETS_TOKEN_FILE)
         
@@ -149,10 +355,8 @@ def oauth2callback():
             state=saved_state
         )
         
-        # 儲存憑證
-        token_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(token_file, 'w', encoding='utf-8') as token:
-            token.write(creds.to_json())
+        # 儲存憑證並丟棄使用舊憑證建立的快取連線
+        GoogleSheetsService.store_credentials(creds, token_file)
         
         logging.info(f"OAuth 授權成功，憑證已儲存到: {token_file}")
         
@@ -171,45 +375,8 @@ def oauth2callback():
         }), 500
 
 if __name__ == '__main__':
-    # 預設 DB 可用性為 False，啟動時檢查後再更新
-    app.config['DB_AVAILABLE'] = False
-
-    with app.app_context():
-        try:
-            # 如果使用 MySQL，嘗試在伺服器上建立資料庫（如果不存在）
-            db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-            if db_uri and db_uri.startswith('mysql'):
-                try:
-                    import pymysql
-
-                    host = app.config.get('DB_HOST', 'localhost')
-                    port = int(app.config.get('DB_PORT', 3306))
-                    user = app.config.get('DB_USER', 'root')
-                    password = app.config.get('DB_PASSWORD', '')
-                    db_name = app.config.get('DB_NAME', '')
-                    charset = app.config.get('DB_CHARSET', 'utf8mb4')
-
-                    conn = pymysql.connect(host=host, port=port, user=user, password=password, charset=charset)
-                    with conn.cursor() as cur:
-                        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET {charset}")
-                    conn.commit()
-                    conn.close()
-                    logging.info(f"確保資料庫存在: {db_name}")
-                except Exception as e:
-                    logging.error(f"無法建立或連線到 MySQL 伺服器: {e}")
-
-            # 嘗試建立資料表（如果連線失敗會拋出例外）
-            try:
-                db.create_all()
-                app.config['DB_AVAILABLE'] = True
-                logging.info('資料表建立檢查完成，DB 可用')
-            except Exception as e:
-                app.config['DB_AVAILABLE'] = False
-                logging.error(f'建立資料表失敗，DB 可能不可用: {e}')
-
-        except Exception as e:
-            app.config['DB_AVAILABLE'] = False
-            logging.error(f"啟動時檢查資料庫發生未預期錯誤: {e}")
-
+    init_database()
+    # debug 模式的 reloader 監看程序不啟動排程，只在實際提供服務的程序中執行
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sync_scheduler.start()
     app.run(debug=True, host='0.0.0.0', port=8080)
-
@@ -0,0 +1,238 @@
+"""
+同步效能測試：以記憶體中的假工作表取代 Google Sheets，對 SQLite 或本機 MySQL 執行 SyncService.sync_data
+
+不需要網路與 Google 帳號，結果以 JSON 輸出，可用來比較不同版本的效能。
+
+使用方式：
+    python benchmark.py                                  # 1k、10k、100k 列，寫入暫存的 SQLite
+    python benchmark.py --rows 1000 500000 --latency 0.2 # 指定列數與每次 API 呼叫的延遲（秒）
+    python benchmark.py --db-url mysql+pymysql://root:pw@localhost/bench --output result.json
+    python benchmark.py --memory                         # 以 tracemalloc 量測記憶體峰值（會降低速度）
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 效能測試使用獨立的狀態檔，且不使用快照與 Drive 修訂檢查（必須在載入設定前設定）
+_work_dir = tempfile.mkdtemp(prefix='sync-benchmark-')
+os.environ['SYNC_STATE_FILE'] = os.path.join(_work_dir, 'sync_state.json')
+os.environ['SNAPSHOT_CACHE'] = 'false'
+os.environ['CONFIG_RELOAD_INTERVAL'] = '0'
+
+from flask import Flask
+from config import reload_config
+from models import db, ActiveReward
+from sheets_service import GoogleSheetsService
+from sync_service import SyncService
+from status_service import reward_counts
+
+HEADERS = ['日期', '執行代號', '角色身分證', '角色ID', '道具編號', '補償道具名稱', '數量', '備註', '已發放']
+
+class FakeWorksheet:
+    """
+    記憶體中的假工作表：實作同步使用的 gspread 方法，每次呼叫加上固定延遲並記錄呼叫次數
+    範圍格式只支援 A2:C100 與 A2:C（開放結尾）
+    """
+    
+    def __init__(self, rows, latency=0.0, invalid_ratio=0.0):
+        self.id = 0
+        self.title = 'benchmark'
+        self.latency = latency
+        self.calls = {}
+        self.values = [list(HEADERS)]
+        invalid_every = int(1 / invalid_ratio) if invalid_ratio > 0 else 0
+        for i in range(rows):
+            count = 'x' if invalid_every and i % invalid_every == 0 else str(i % 10 + 1)
+            self.values.append([
+                '2025-01-01', str(i % 50), f'char{i}', f'角色{i}', str(40000 + i % 300),
+                f'道具{i % 300}', count, '', ''
+            ])
+        # 與 gspread 相同：列數與欄數放在 _properties，讀取前由 GoogleSheetsService 以試算表 metadata 更新
+        self._properties = {'sheetId': self.id, 'gridProperties': {'rowCount': len(self.values), 'columnCount': len(HEADERS)}}
+    
+    @property
+    def row_count(self):
+        return self._properties['gridProperties']['rowCount']
+    
+    @property
+    def col_count(self):
+        return self._properties['gridProperties']['columnCount']
+    
+    def _call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def get_all_values(self):
+        self._call('get_all_values')
+        return [list(row) for row in self.values]
+    
+    def row_values(self, row):
+        self._call('row_values')
+        return list(self.values[row - 1]) if row <= len(self.values) else []
+    
+    def batch_get(self, ranges):
+        self._call('batch_get')
+        results = []
+        for cell_range in ranges:
+            first_col, first_row, last_col, last_row = self._parse_range(cell_range)
+            rows = [row[first_col:last_col + 1] for row in self.values[first_row - 1:last_row]]
+            # 與 API 相同：省略尾端的空白儲存格與空白列
+            rows = [row[:max((i + 1 for i, value in enumerate(row) if value), default=0)] for row in rows]
+            while rows and not rows[-1]:
+                rows.pop()
+            results.append(rows)
+        return results
+    
+    def update(self, cell_range, value):
+        self._call('update')
+        first_col, first_row, _, _ = self._parse_range(cell_range)
+        self.values[first_row - 1][first_col] = value
+    
+    def batch_update(self, data):
+        self._call('batch_update')
+        for item in data:
+            first_col, first_row, _, last_row = self._parse_range(item['range'])
+            for offset, row_number in enumerate(range(first_row, last_row + 1)):
+                self.values[row_number - 1][first_col] = item['values'][offset][0]
+    
+    def _parse_range(self, cell_range):
+        match = re.match(r'([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?$', cell_range)
+        first_col = self._column_index(match.group(1))
+        last_col = self._column_index(match.group(3)) if match.group(3) else first_col
+        first_row = int(match.group(2))
+        if match.group(4):
+            last_row = int(match.group(4))
+        elif match.group(3):
+            last_row = len(self.values)
+        else:
+            last_row = first_row
+        return first_col, first_row, last_col, last_row
+    
+    @staticmethod
+    def _column_index(letters):
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - 64
+        return index - 1
+
+class FakeSpreadsheet:
+    """假工作表所屬的試算表：只提供讀取前更新列數用的 fetch_sheet_metadata（計入工作表的 API 呼叫次數）"""
+    
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+    
+    def fetch_sheet_metadata(self, params=None):
+        self.worksheet._call('fetch_sheet_metadata')
+        properties = {'sheetId': self.worksheet.id, 'gridProperties': {'rowCount': len(self.worksheet.values), 'columnCount': len(HEADERS)}}
+        return {'sheets': [{'properties': properties}]}
+
+def run_benchmark(app, rows, args):
+    """執行一次同步並回傳統計結果"""
+    worksheet = FakeWorksheet(rows, latency=args.latency, invalid_ratio=args.invalid_ratio)
+    
+    def fake_connect(self):
+        self.client = None
+        self.spreadsheet = FakeSpreadsheet(worksheet)
+        self.worksheet = worksheet
+    
+    GoogleSheetsService._connect = fake_connect
+    if os.path.exists(os.environ['SYNC_STATE_FILE']):
+        os.remove(os.environ['SYNC_STATE_FILE'])
+    
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        reward_counts.invalidate()
+        
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = SyncService(batch_size=args.batch_size).sync_data()
+        elapsed = time.perf_counter() - started
+        peak_memory = None
+        if args.memory:
+            peak_memory = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+            tracemalloc.stop()
+        
+        db_rows = db.session.query(db.func.count(ActiveReward.id)).scalar()
+    
+    return {
+        'rows': rows,
+        'success': result.get('success'),
+        'message': result.get('message'),
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(result.get('count', 0) / elapsed, 1) if elapsed > 0 else 0.0,
+        'inserted': db_rows,
+        'confirmed': result.get('count', 0),
+        'errors': result.get('error_count', 0),
+        'api_calls': dict(worksheet.calls),
+        'api_call_total': sum(worksheet.calls.values()),
+        'peak_memory_mb': peak_memory,
+        'stages': result.get('stages')
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='同步效能測試（假工作表 + SQLite/MySQL）')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='工作表資料列數（可指定多個）')
+    parser.add_argument('--latency', type=float, default=0.05, help='每次 Sheets API 呼叫的延遲秒數')
+    parser.add_argument('--invalid-ratio', type=float, default=0.0, help='驗證失敗的資料列比例（例如 0.01）')
+    parser.add_argument('--batch-size', type=int, default=None, help='每批寫入資料庫的筆數（預設使用 SYNC_BATCH_SIZE）')
+    parser.add_argument('--page-size', type=int, default=None, help='每頁讀取的列數（預設使用 SYNC_PAGE_SIZE）')
+    parser.add_argument('--read-workers', type=int, default=None, help='同時下載的分頁數（預設使用 SYNC_READ_WORKERS）')
+    parser.add_argument('--quota', type=int, default=0, help='Sheets API 每分鐘配額，0 表示不限制（只量測同步流程本身）')
+    parser.add_argument('--db-url', default=None, help='資料庫連線字串（預設為暫存目錄中的 SQLite）')
+    parser.add_argument('--memory', action='store_true', help='以 tracemalloc 量測記憶體峰值（會降低速度）')
+    parser.add_argument('--output', default=None, help='將 JSON 結果寫入檔案')
+    args = parser.parse_args()
+    
+    quota = str(args.quota if args.quota > 0 else 10 ** 9)
+    os.environ['SHEETS_READ_QUOTA'] = quota
+    os.environ['SHEETS_WRITE_QUOTA'] = quota
+    if args.page_size:
+        os.environ['SYNC_PAGE_SIZE'] = str(args.page_size)
+    if args.read_workers:
+        os.environ['SYNC_READ_WORKERS'] = str(args.read_workers)
+    config = reload_config()
+    
+    db_url = args.db_url or 'sqlite:///' + os.path.join(_work_dir, 'benchmark.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+    if db_url.startswith('mysql'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config.SQLALCHEMY_ENGINE_OPTIONS
+    db.init_app(app)
+    
+    results = []
+    for rows in args.rows:
+        print(f"執行 {rows} 列...", file=sys.stderr)
+        results.append(run_benchmark(app, rows, args))
+    
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': db_url.split(':', 1)[0],
+        'params': {
+            'latency': args.latency,
+            'invalid_ratio': args.invalid_ratio,
+            'batch_size': args.batch_size or config.SYNC_BATCH_SIZE,
+            'page_size': config.SYNC_PAGE_SIZE,
+            'read_workers': config.SYNC_READ_WORKERS,
+            'quota_per_minute': args.quota or None
+        },
+        'results': results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
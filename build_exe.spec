@@ -14,6 +14,9 @@ a = Analysis(
         'flask_cors',
         'gspread',
         'google.oauth2.service_account',
+        'google.oauth2.credentials',
+        'google.auth.transport.requests',
+        'google_auth_oauthlib.flow',
         'pymysql',
         'sqlalchemy',
         'flask_sqlalchemy',
@@ -54,3 +57,60 @@ exe = EXE(
     entitlements_file=None,
 )
 
+# 命令列同步（sync_cli.py）：不包含網頁伺服器相關套件；
+# 以資料夾形式輸出（dist/activeRewardSync/），每次執行不需要先解壓縮，啟動較單一檔案快
+# 執行時讀取 exe 所在資料夾中的 config 目錄
+cli_a = Analysis(
+    ['sync_cli.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[
+        'gspread',
+        'google.oauth2.credentials',
+        'google.auth.transport.requests',
+        'google_auth_oauthlib.flow',
+        'pymysql',
+        'sqlalchemy',
+        'flask_sqlalchemy',
+    ],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['flask_cors', 'tkinter'],
+    win_no_prefer_redirects=False,
+    win_private_assemblies=False,
+    cipher=block_cipher,
+    noarchive=False,
+)
+
+cli_pyz = PYZ(cli_a.pure, cli_a.zipped_data, cipher=block_cipher)
+
+cli_exe = EXE(
+    cli_pyz,
+    cli_a.scripts,
+    [],
+    exclude_binaries=True,
+    name='activeRewardSync',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,  # UPX 壓縮的檔案每次啟動都要解壓縮，命令列版本不使用
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+cli_coll = COLLECT(
+    cli_exe,
+    cli_a.binaries,
+    cli_a.zipfiles,
+    cli_a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='activeRewardSync',
+)
@@ -1,6 +1,9 @@
 import os
 import json
 import sys
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -22,6 +25,11 @@ class Config:
         mysql_config_path = config_dir / 'mysql_config.json'
         cloud_config_path = config_dir / 'cloud_csv_config.json'
         
+        # 設定檔清單（熱重新載入時依修改時間判斷是否變更）
+        self._config_files = [mysql_config_path, cloud_config_path]
+        self._load_errors = []
+        self._frozen = False
+        
         # 讀取 MySQL 設定
         self._load_mysql_config(mysql_config_path)
         
@@ -30,6 +38,59 @@ class Config:
         
         # Flask 設定（仍使用環境變數或預設值）
         self.SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+        
+        # 同步設定：每批寫入資料庫的筆數
+        self.SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 500))
+        # 每次從 Google Sheets 讀取的列數（讀取、寫入資料庫與回寫確認以分頁重疊進行）
+        self.SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 5000))
+        # 大型工作表同時下載的分頁數量（依工作表 row_count 切分，受 Sheets API 讀取配額限制）
+        self.SYNC_READ_WORKERS = int(os.getenv('SYNC_READ_WORKERS', 4))
+        # 管線各階段之間的佇列長度上限（控制記憶體用量）
+        self.SYNC_QUEUE_SIZE = int(os.getenv('SYNC_QUEUE_SIZE', 2))
+        # 背景同步工作的執行緒數量
+        self.SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', 2))
+        # 設定多個工作表（sources）時，同時同步的工作表數量
+        self.SYNC_SOURCE_WORKERS = int(os.getenv('SYNC_SOURCE_WORKERS', 4))
+        # 排程同步：間隔在 SYNC_INTERVAL_MIN 到 SYNC_INTERVAL_MAX 秒之間調整，
+        # 連續沒有待處理資料時乘以 SYNC_INTERVAL_BACKOFF 拉長間隔，讀到待處理資料時回到最短間隔；
+        # 多個 worker 程序時只有取得 MySQL 排程鎖的程序執行排程同步
+        self.SYNC_SCHEDULE = os.getenv('SYNC_SCHEDULE', 'false').lower() in ('1', 'true', 'yes')
+        self.SYNC_INTERVAL_MIN = int(os.getenv('SYNC_INTERVAL_MIN', 60))
+        self.SYNC_INTERVAL_MAX = int(os.getenv('SYNC_INTERVAL_MAX', 1800))
+        self.SYNC_INTERVAL_BACKOFF = float(os.getenv('SYNC_INTERVAL_BACKOFF', 2.0))
+        # 排程等待單次同步完成的最長秒數；逾時後排程繼續運作，仍在執行的工作由單一工作機制避免重複
+        self.SYNC_JOB_TIMEOUT = int(os.getenv('SYNC_JOB_TIMEOUT', 1800))
+        # 多個 worker 程序部署時，以 MySQL GET_LOCK 確保同一工作表只有一個同步流程
+        self.SYNC_DB_LOCK = os.getenv('SYNC_DB_LOCK', 'false').lower() in ('1', 'true', 'yes')
+        self.SYNC_DB_LOCK_TIMEOUT = int(os.getenv('SYNC_DB_LOCK_TIMEOUT', 0))
+        
+        # Google Sheets API 每分鐘請求配額（讀取、寫入分開計算），以及 429/5xx 的重試次數與退避秒數
+        self.SHEETS_READ_QUOTA = int(os.getenv('SHEETS_READ_QUOTA', 60))
+        self.SHEETS_WRITE_QUOTA = int(os.getenv('SHEETS_WRITE_QUOTA', 60))
+        self.SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', 5))
+        self.SHEETS_BACKOFF_BASE = float(os.getenv('SHEETS_BACKOFF_BASE', 1.0))
+        self.SHEETS_BACKOFF_MAX = float(os.getenv('SHEETS_BACKOFF_MAX', 64.0))
+        
+        # /api/status 筆數快取的有效秒數（過期後先回傳舊值並在背景重新計算）
+        self.STATUS_CACHE_TTL = int(os.getenv('STATUS_CACHE_TTL', 30))
+        
+        # /api/rewards 每頁筆數的預設值與上限
+        self.REWARDS_PAGE_SIZE = int(os.getenv('REWARDS_PAGE_SIZE', 100))
+        self.REWARDS_MAX_PAGE_SIZE = int(os.getenv('REWARDS_MAX_PAGE_SIZE', 1000))
+        
+        # 增量讀取設定：記錄已全部確認的最後一行（高水位），下次只讀取之後的資料列
+        self.SYNC_STATE_FILE = os.getenv('SYNC_STATE_FILE', str(config_dir / 'sync_state.json'))
+        self.INCREMENTAL_READ = os.getenv('INCREMENTAL_READ', 'true').lower() in ('1', 'true', 'yes')
+        # 每隔多少秒強制完整掃描一次（找出被手動清除「已發放」的舊資料列），0 表示每次都完整掃描
+        self.FULL_RESCAN_INTERVAL = int(os.getenv('FULL_RESCAN_INTERVAL', 3600))
+        # 試算表內容快照（SQLite）：修訂沒有變更時不下載工作表，並略過內容未變更且已被拒絕的資料列
+        self.SNAPSHOT_CACHE = os.getenv('SNAPSHOT_CACHE', 'true').lower() in ('1', 'true', 'yes')
+        self.SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', str(config_dir / 'sheet_snapshot.db'))
+        # Sheets API 流量錄製/重播（record 錄製實際同步的 HTTP 往返，replay 由本機替身伺服器回應，不需要網路）
+        # 重播速度：1 依原始耗時、2 為兩倍速、0 不延遲
+        self.SHEETS_TRAFFIC_MODE = os.getenv('SHEETS_TRAFFIC_MODE', '').lower()
+        self.SHEETS_TRAFFIC_FILE = os.getenv('SHEETS_TRAFFIC_FILE', str(config_dir / 'sheets_traffic.jsonl'))
+        self.SHEETS_REPLAY_SPEED = float(os.getenv('SHEETS_REPLAY_SPEED', 1.0))
     
     def _load_mysql_config(self, config_path):
         """讀取 MySQL 設定檔"""
@@ -43,8 +104,10 @@ class Config:
                     self.DB_PASSWORD = mysql_config.get('password', '')
                     self.DB_NAME = mysql_config.get('database', 'active_reward_db')
                     self.DB_CHARSET = mysql_config.get('charset', 'utf8mb4')
+                    self._load_engine_options(mysql_config)
             except (json.JSONDecodeError, KeyError, ValueError) as e:
                 print(f"警告：讀取 MySQL 設定檔失敗，使用預設值: {e}")
+                self._load_errors.append(f"{config_path}: {e}")
                 self._set_default_mysql_config()
         else:
             print(f"警告：找不到 MySQL 設定檔 {config_path}，使用預設值")
@@ -58,6 +121,48 @@ class Config:
         self.DB_PASSWORD = os.getenv('DB_PASSWORD', '')
         self.DB_NAME = os.getenv('DB_NAME', 'active_reward_db')
         self.DB_CHARSET = 'utf8mb4'
+        self._load_engine_options({})
+    
+    def _load_engine_options(self, mysql_config):
+        """
+        讀取連線池與 MySQL 連線設定（mysql_config.json 中的 "engine" 區塊，或環境變數）
+        
+        範例：
+            "engine": {
+                "pool_size": 5,
+                "max_overflow": 10,
+                "pool_recycle": 1800,
+                "pool_pre_ping": true,
+                "pool_timeout": 30,
+                "connect_timeout": 10,
+                "isolation_level": "READ COMMITTED",
+                "init_command": "SET SESSION innodb_lock_wait_timeout = 10",
+                "bulk_autocommit": false,
+                "server_side_cursors": true
+            }
+        """
+        engine_config = mysql_config.get('engine', {})
+        
+        def option(name, default):
+            return engine_config.get(name, os.getenv(f'DB_{name.upper()}', default))
+        
+        def flag(name, default):
+            value = option(name, default)
+            return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+        
+        self.DB_POOL_SIZE = int(option('pool_size', 5))
+        self.DB_MAX_OVERFLOW = int(option('max_overflow', 10))
+        # 必須小於 MySQL 的 wait_timeout，避免閒置後拿到已被伺服器關閉的連線
+        self.DB_POOL_RECYCLE = int(option('pool_recycle', 1800))
+        self.DB_POOL_PRE_PING = flag('pool_pre_ping', True)
+        self.DB_POOL_TIMEOUT = int(option('pool_timeout', 30))
+        self.DB_CONNECT_TIMEOUT = int(option('connect_timeout', 10))
+        self.DB_ISOLATION_LEVEL = option('isolation_level', '') or None
+        self.DB_INIT_COMMAND = option('init_command', '') or None
+        # 同步大量寫入時使用 autocommit 連線（每個多筆 INSERT 各自提交，不另開交易）
+        self.DB_BULK_AUTOCOMMIT = flag('bulk_autocommit', False)
+        # 查詢 API 以伺服器端游標串流結果
+        self.DB_SERVER_SIDE_CURSORS = flag('server_side_cursors', True)
     
     def _load_cloud_config(self, config_path):
         """讀取 Google Sheets 設定檔"""
@@ -94,8 +199,10 @@ class Config:
                     self.SPREADSHEET_ID = cloud_config.get('spreadsheet_id', '')
                     self.WORKSHEET_NAME = cloud_config.get('worksheet_name', '')
                     self.WORKSHEET_GID = cloud_config.get('worksheet_gid', '')
+                    self.SHEET_SOURCES = self._parse_sources(cloud_config.get('sources'))
             except (json.JSONDecodeError, KeyError, ValueError) as e:
                 print(f"警告：讀取 Google Sheets 設定檔失敗，使用預設值: {e}")
+                self._load_errors.append(f"{config_path}: {e}")
                 self._set_default_cloud_config()
         else:
             print(f"警告：找不到 Google Sheets 設定檔 {config_path}，使用預設值")
@@ -111,8 +218,145 @@ class Config:
         self.SPREADSHEET_ID = os.getenv('SPREADSHEET_ID', '1T70siVXhG8VcERTGtVKiSdWPfc6eHc4dt-SGOt9ppE4')
         self.WORKSHEET_NAME = os.getenv('WORKSHEET_NAME', '神說外交官')
         self.WORKSHEET_GID = os.getenv('WORKSHEET_GID', '1753592588')
+        self.SHEET_SOURCES = self._parse_sources(None)
+    
+    def _parse_sources(self, sources):
+        """
+        解析要同步的工作表清單（cloud_csv_config.json 的 sources）
+        每個項目可指定 spreadsheet_id、worksheet_name、worksheet_gid，未指定的 spreadsheet_id 沿用最上層的設定；
+        沒有 sources 時只同步最上層設定的單一工作表
+        
+        Returns:
+            list: [{'spreadsheet_id', 'worksheet_name', 'worksheet_gid'}, ...]
+        """
+        if not sources:
+            sources = [{}]
+        if not isinstance(sources, list):
+            raise ValueError("sources 必須是工作表設定的清單")
+        
+        parsed = []
+        for source in sources:
+            if not isinstance(source, dict):
+                raise ValueError(f"sources 項目格式錯誤: {source!r}")
+            # 只有 spreadsheet_id 的項目沿用最上層的工作表設定，否則只使用項目本身的工作表設定
+            own_worksheet = 'worksheet_name' in source or 'worksheet_gid' in source
+            parsed.append({
+                'spreadsheet_id': source.get('spreadsheet_id') or self.SPREADSHEET_ID,
+                'worksheet_name': source.get('worksheet_name', '') if own_worksheet else self.WORKSHEET_NAME,
+                'worksheet_gid': str(source.get('worksheet_gid', '') if own_worksheet else self.WORKSHEET_GID)
+            })
+        return parsed
+    
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"設定快照為唯讀，無法修改 {name}")
+        super().__setattr__(name, value)
+    
+    def freeze(self):
+        """將設定轉為唯讀快照（供多個執行緒共用）"""
+        self._frozen = True
+        return self
+    
+    def file_mtimes(self):
+        """設定檔的修改時間（檔案不存在時為 None）"""
+        return {str(path): (path.stat().st_mtime if path.exists() else None) for path in self._config_files}
+    
+    @property
+    def SQLALCHEMY_ENGINE_OPTIONS(self):
+        """Flask-SQLAlchemy 建立 engine 時使用的連線池設定"""
+        connect_args = {'connect_timeout': self.DB_CONNECT_TIMEOUT}
+        if self.DB_INIT_COMMAND:
+            connect_args['init_command'] = self.DB_INIT_COMMAND
+        options = {
+            'pool_size': self.DB_POOL_SIZE,
+            'max_overflow': self.DB_MAX_OVERFLOW,
+            'pool_recycle': self.DB_POOL_RECYCLE,
+            'pool_pre_ping': self.DB_POOL_PRE_PING,
+            'pool_timeout': self.DB_POOL_TIMEOUT,
+            'connect_args': connect_args
+        }
+        if self.DB_ISOLATION_LEVEL:
+            options['isolation_level'] = self.DB_ISOLATION_LEVEL
+        return options
     
     @property
     def SQLALCHEMY_DATABASE_URI(self):
         return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}?charset={self.DB_CHARSET}"
 
+# 程序層級的設定快照：請求處理時只讀取記憶體中的快照，不會讀取設定檔；
+# 背景執行緒每隔 CONFIG_RELOAD_INTERVAL 秒檢查設定檔修改時間，有變更時重新載入並替換快照
+CONFIG_RELOAD_INTERVAL = float(os.getenv('CONFIG_RELOAD_INTERVAL', 5))
+
+_config_lock = threading.Lock()
+_config_snapshot = None
+_config_mtimes = {}
+_config_stats = {'reload_count': 0, 'loaded_at': None, 'last_error': None}
+_config_watcher = None
+
+def get_config():
+    """取得目前的設定快照（第一次呼叫時載入並啟動檔案監看）"""
+    snapshot = _config_snapshot
+    if snapshot is None:
+        with _config_lock:
+            if _config_snapshot is None:
+                _load_snapshot()
+                _start_watcher()
+            snapshot = _config_snapshot
+    return snapshot
+
+def reload_config():
+    """立即重新載入設定檔並替換快照"""
+    with _config_lock:
+        _load_snapshot()
+    return _config_snapshot
+
+def config_stats():
+    """設定載入狀態（重新載入次數、最後載入時間），供維運查詢"""
+    return {
+        'reload_count': _config_stats['reload_count'],
+        'loaded_at': _config_stats['loaded_at'],
+        'last_error': _config_stats['last_error'],
+        'files': dict(_config_mtimes)
+    }
+
+def _load_snapshot(strict=False):
+    """
+    載入新的設定快照（呼叫端需持有 _config_lock）
+    strict=True 時，設定檔格式錯誤（例如編輯到一半）會拋出例外並保留目前的快照，而不是改用預設值
+    """
+    global _config_snapshot, _config_mtimes
+    config = Config()
+    if strict and config._load_errors:
+        raise ValueError('; '.join(config._load_errors))
+    _config_mtimes = config.file_mtimes()
+    _config_snapshot = config.freeze()
+    if _config_stats['loaded_at'] is not None:
+        _config_stats['reload_count'] += 1
+    _config_stats['loaded_at'] = datetime.now().isoformat()
+    _config_stats['last_error'] = None
+
+def _start_watcher():
+    """啟動設定檔監看執行緒（只會啟動一次）"""
+    global _config_watcher
+    if _config_watcher is not None or CONFIG_RELOAD_INTERVAL <= 0:
+        return
+    
+    def watch():
+        global _config_mtimes
+        while True:
+            time.sleep(CONFIG_RELOAD_INTERVAL)
+            mtimes = _config_snapshot.file_mtimes()
+            if mtimes == _config_mtimes:
+                continue
+            try:
+                with _config_lock:
+                    _load_snapshot(strict=True)
+                print(f"設定檔已變更，已重新載入（第 {_config_stats['reload_count']} 次）")
+            except Exception as e:
+                # 記錄這次的修改時間，設定檔再次修改前不重複嘗試
+                _config_mtimes = mtimes
+                _config_stats['last_error'] = str(e)
+                print(f"警告：重新載入設定檔失敗，繼續使用目前設定: {e}")
+    
+    _config_watcher = threading.Thread(target=watch, name='config-watcher', daemon=True)
+    _config_watcher.start()
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+from sync_service import sync_sources
+from sheets_service import source_key
+from config import get_config
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 保留的已結束工作數量上限（超過時移除最舊的紀錄）
+MAX_FINISHED_JOBS = 100
+
+class SyncJobManager:
+    """背景同步工作管理（程序內執行緒池，不需要外部訊息佇列）"""
+    
+    def __init__(self, app, max_workers=2):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync-job')
+        self.jobs = OrderedDict()
+        # 每個試算表/工作表執行中的工作：(spreadsheet_id, 工作表) -> job_id
+        self.inflight = {}
+        self.lock = threading.Lock()
+    
+    def submit(self, **sync_kwargs):
+        """
+        建立同步工作並放入背景執行緒池
+        同一個工作表已有排隊中或執行中的工作時，不建立新工作，直接回傳該工作（joined=True）
+        
+        Returns:
+            dict: 工作狀態（包含 job_id）
+        """
+        key = self._sheet_key()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'started': None,
+            'finished': None,
+            'progress': {
+                'rows_read': 0,
+                'inserted': 0,
+                'duplicates': 0,
+                'confirmed': 0,
+                'failed': 0
+            },
+            'result': None,
+            'error': None,
+            'done': threading.Event()
+        }
+        # 檢查與登記必須在同一次持有鎖時完成，否則同時送出的請求可能都通過檢查而建立兩個工作
+        with self.lock:
+            inflight_id = self.inflight.get(key)
+            if inflight_id in self.jobs and self.jobs[inflight_id]['finished'] is None:
+                logger.info(f"同一工作表已有同步工作執行中，加入工作: {inflight_id}")
+                return dict(self._snapshot(self.jobs[inflight_id]), joined=True)
+            self.jobs[job['job_id']] = job
+            self.inflight[key] = job['job_id']
+            self._evict_finished()
+        self.executor.submit(self._run, job, key, sync_kwargs)
+        logger.info(f"已建立同步工作: {job['job_id']}")
+        return self._snapshot(job)
+    
+    def get(self, job_id):
+        """取得工作狀態，找不到時回傳 None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+    
+    def wait(self, job_id, timeout=None):
+        """等待工作結束並回傳工作狀態（逾時仍會回傳目前狀態），找不到時回傳 None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job['done'].wait(timeout)
+        return self.get(job_id)
+    
+    def _sheet_key(self):
+        """要同步的所有工作表的識別鍵（與 GoogleSheetsService 的連線快取鍵值相同；讀取目前的設定快照，設定檔變更後立即生效）"""
+        return tuple(source_key(source) for source in get_config().SHEET_SOURCES)
+    
+    def _run(self, job, key, sync_kwargs):
+        """在背景執行緒中執行同步（需要 Flask app context 才能使用 db.session）"""
+        job['status'] = 'running'
+        job['started'] = time.time()
+        try:
+            with self.app.app_context():
+                result = sync_sources(progress=job['progress'], **sync_kwargs)
+            job['result'] = result
+            job['status'] = 'completed' if result.get('success') else 'failed'
+            if not result.get('success'):
+                job['error'] = result.get('message')
+        except Exception as e:
+            logger.exception(f"同步工作 {job['job_id']} 失敗")
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            job['finished'] = time.time()
+            with self.lock:
+                if self.inflight.get(key) == job['job_id']:
+                    del self.inflight[key]
+            job['done'].set()
+    
+    def _evict_finished(self):
+        """移除最舊的已結束工作，避免工作紀錄無限制成長"""
+        finished = [job_id for job_id, job in self.jobs.items() if job['finished'] is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+    
+    @staticmethod
+    def _snapshot(job):
+        """將工作轉換為 API 回應格式（包含經過時間與每秒處理筆數）"""
+        progress = dict(job['progress'])
+        elapsed = 0.0
+        if job['started'] is not None:
+            elapsed = (job['finished'] or time.time()) - job['started']
+        processed = progress['inserted'] + progress['duplicates'] + progress['failed']
+        progress['elapsed'] = round(elapsed, 3)
+        progress['rows_per_sec'] = round(processed / elapsed, 1) if elapsed > 0 else 0.0
+        return {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'progress': progress,
+            'result': job['result'],
+            'error': job['error']
+        }
@@ -0,0 +1,150 @@
+"""
+程序內的監控指標（Prometheus 文字格式，由 /metrics 輸出）
+
+只在每頁、每批或每次 API 呼叫時更新計數，不會逐列記錄，可在正式環境持續開啟。
+"""
+from bisect import bisect_left
+import threading
+
+# 延遲直方圖的分界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _format_labels(pairs):
+    """標籤字串，例如 {stage="read",le="0.5"}（沒有標籤時為空字串）"""
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class _Metric:
+    """指標基礎類別：依標籤值分別記錄"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+    
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        return _format_labels(pairs)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted(self.values.items())
+        lines.extend(self._render_samples(items))
+        return lines
+
+class Counter(_Metric):
+    """只會增加的累計值"""
+    
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def _render_samples(self, items):
+        return [f'{self.name}{self._format_labels(key)} {value}' for key, value in items]
+
+class Gauge(_Metric):
+    """目前的數值（可增可減）"""
+    
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+    
+    def _render_samples(self, items):
+        return [f'{self.name}{self._format_labels(key)} {value}' for key, value in items]
+
+class Histogram(_Metric):
+    """延遲分布：各分界的累計次數、總和與次數"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+    
+    def _render_samples(self, items):
+        lines = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['counts']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", "+Inf"))} {entry["count"]}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {round(entry["sum"], 6)}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {entry["count"]}')
+        return lines
+
+class Registry:
+    """指標集合；collectors 為輸出時才計算的指標（例如連線池狀態）"""
+    
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def add_collector(self, collector):
+        """collector() 回傳 [(名稱, 說明, 類型, [(標籤字典, 數值), ...]), ...]"""
+        self.collectors.append(collector)
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, documentation, kind, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(list(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+sync_runs = registry.register(Counter(
+    'sync_runs_total', '同步執行次數（依結果）', ['result']))
+sync_rows = registry.register(Counter(
+    'sync_rows_total', '同步處理的資料列數（read 讀取、inserted 寫入、confirmed 回寫確認、failed 失敗）', ['outcome']))
+sync_stage_seconds = registry.register(Histogram(
+    'sync_stage_seconds', '同步各階段每頁/每批的處理時間（read 讀取試算表、parse 解析、write 寫入資料庫、confirm 回寫確認）', ['stage']))
+sync_duration_seconds = registry.register(Histogram(
+    'sync_duration_seconds', '單次同步的總時間'))
+sync_rows_per_second = registry.register(Gauge(
+    'sync_last_rows_per_second', '最近一次同步每秒寫入的資料列數'))
+sheets_api_requests = registry.register(Counter(
+    'sheets_api_requests_total', 'Google Sheets API 呼叫次數（依方法與結果）', ['method', 'result']))
+sheets_api_seconds = registry.register(Histogram(
+    'sheets_api_request_seconds', 'Google Sheets API 呼叫時間（依方法）', ['method']))
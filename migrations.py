@@ -0,0 +1,194 @@
+"""
+資料庫結構版本管理（內建的遷移執行器）
+
+db.create_all() 只會建立不存在的資料表，不會修改既有的 active_reward，
+因此新增的欄位與索引以版本化的遷移套用到既有資料表。
+MySQL 上使用 InnoDB 線上 DDL（ALGORITHM=INPLACE, LOCK=NONE），套用期間同步仍可讀寫資料表。
+
+使用方式：
+    python migrations.py            # 套用尚未執行的遷移（app.py 與 sync_cli.py 啟動時也會自動套用）
+    python migrations.py --status   # 顯示各遷移的狀態
+"""
+from models import db, ActiveReward
+from sqlalchemy import inspect, text
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 記錄已套用遷移的資料表
+VERSION_TABLE = 'schema_migrations'
+
+# 多個程序同時啟動時，只讓一個程序執行遷移
+MIGRATION_LOCK_NAME = 'active_reward_migrations'
+MIGRATION_LOCK_TIMEOUT = 60
+
+def _add_source_columns(conn):
+    """新增來源識別鍵欄位（source_spreadsheet_id、source_gid、source_row、source_hash）"""
+    for name in ('source_spreadsheet_id', 'source_gid', 'source_row', 'source_hash'):
+        _add_column(conn, name)
+
+def _add_source_unique_index(conn):
+    """新增來源識別鍵唯一索引（重複寫入時以此略過）"""
+    _add_index(conn, 'uq_active_reward_source')
+
+def _add_query_indexes(conn):
+    """新增查詢與篩選用的次要索引"""
+    for name in (
+        'ix_active_reward_round',
+        'ix_active_reward_char_id_state',
+        'ix_active_reward_char_name',
+        'ix_active_reward_item_id',
+        'ix_active_reward_end_time',
+    ):
+        _add_index(conn, name)
+
+def _add_keyset_indexes(conn):
+    """新增只篩選 state 或 char_id 時，依 id 分頁也能直接走索引的複合索引"""
+    for name in (
+        'ix_active_reward_state_id',
+        'ix_active_reward_char_id_id',
+    ):
+        _add_index(conn, name)
+
+# (版本, 說明, 套用函式)；版本號只能遞增，已發布的遷移不可修改
+MIGRATIONS = [
+    (1, '新增來源識別鍵欄位', _add_source_columns),
+    (2, '新增來源識別鍵唯一索引', _add_source_unique_index),
+    (3, '新增查詢用次要索引', _add_query_indexes),
+    (4, '新增 state、char_id 分頁用複合索引', _add_keyset_indexes),
+]
+
+def _online_ddl_suffix(conn):
+    """MySQL 的線上 DDL 選項（不鎖表）"""
+    return ', ALGORITHM=INPLACE, LOCK=NONE' if conn.dialect.name == 'mysql' else ''
+
+def _add_column(conn, name):
+    """依 ActiveReward 模型的定義新增欄位（已存在時略過）"""
+    table = ActiveReward.__table__
+    existing = set(column['name'] for column in inspect(conn).get_columns(table.name))
+    if name in existing:
+        logger.info(f"欄位 {name} 已存在，略過")
+        return
+    column_type = table.c[name].type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type} NULL{_online_ddl_suffix(conn)}"))
+    logger.info(f"已新增欄位 {name} {column_type}")
+
+def _add_index(conn, name):
+    """依 ActiveReward 模型的定義新增索引或唯一限制（已存在時略過）"""
+    table = ActiveReward.__table__
+    inspector = inspect(conn)
+    existing = set(index['name'] for index in inspector.get_indexes(table.name))
+    existing.update(constraint['name'] for constraint in inspector.get_unique_constraints(table.name))
+    if name in existing:
+        logger.info(f"索引 {name} 已存在，略過")
+        return
+    
+    unique = False
+    columns = None
+    for index in table.indexes:
+        if index.name == name:
+            unique = index.unique
+            columns = [column.name for column in index.columns]
+    for constraint in table.constraints:
+        if constraint.name == name:
+            unique = True
+            columns = [column.name for column in constraint.columns]
+    if columns is None:
+        raise ValueError(f"模型中沒有定義索引 {name}")
+    
+    column_list = ', '.join(columns)
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(f"ALTER TABLE {table.name} ADD {kind} {name} ({column_list}){_online_ddl_suffix(conn)}"))
+    else:
+        conn.execute(text(f"CREATE {kind} {name} ON {table.name} ({column_list})"))
+    logger.info(f"已新增索引 {name} ({column_list})")
+
+def _ensure_version_table(conn):
+    """建立記錄遷移版本的資料表（已存在時略過）"""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version INTEGER NOT NULL PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at DATETIME NOT NULL)"
+    ))
+
+def applied_versions(engine):
+    """取得已套用的遷移版本"""
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return set(row[0] for row in conn.execute(text(f"SELECT version FROM {VERSION_TABLE}")))
+
+def run_migrations(engine):
+    """
+    依版本順序套用尚未執行的遷移
+    
+    Returns:
+        list: 本次套用的版本號
+    """
+    applied = []
+    with engine.connect() as lock_conn:
+        is_mysql = engine.dialect.name == 'mysql'
+        if is_mysql:
+            acquired = lock_conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"),
+                {'name': MIGRATION_LOCK_NAME, 'timeout': MIGRATION_LOCK_TIMEOUT}
+            ).scalar()
+            if acquired != 1:
+                raise RuntimeError('其他程序正在執行資料庫遷移，請稍後再試')
+        try:
+            done = applied_versions(engine)
+            for version, name, migrate in MIGRATIONS:
+                if version in done:
+                    continue
+                logger.info(f"套用資料庫遷移 {version}: {name}")
+                with engine.begin() as conn:
+                    migrate(conn)
+                    conn.execute(
+                        text(f"INSERT INTO {VERSION_TABLE} (version, name, applied_at) VALUES (:version, :name, CURRENT_TIMESTAMP)"),
+                        {'version': version, 'name': name}
+                    )
+                applied.append(version)
+        finally:
+            if is_mysql:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': MIGRATION_LOCK_NAME})
+    
+    if applied:
+        logger.info(f"資料庫遷移完成，套用版本: {applied}")
+    return applied
+
+def schema_current(engine):
+    """所有遷移是否都已套用（只讀取版本資料表，不建立資料表；版本資料表不存在時拋出例外）"""
+    with engine.connect() as conn:
+        done = set(row[0] for row in conn.execute(text(f"SELECT version FROM {VERSION_TABLE}")))
+    return all(version in done for version, _, _ in MIGRATIONS)
+
+def ensure_schema(engine):
+    """
+    建立不存在的資料表（新資料表會直接包含所有欄位與索引）並套用尚未執行的遷移
+    每個會寫入資料庫的進入點啟動時呼叫（app.py、sync_cli.py）
+    
+    Returns:
+        list: 本次套用的版本號
+    """
+    db.metadata.create_all(engine)
+    return run_migrations(engine)
+
+if __name__ == '__main__':
+    from config import Config
+    from sqlalchemy import create_engine
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    config = Config()
+    engine = create_engine(config.SQLALCHEMY_DATABASE_URI, **config.SQLALCHEMY_ENGINE_OPTIONS)
+    if '--status' in sys.argv:
+        done = applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:>4}  {'已套用' if version in done else '未套用'}  {name}")
+    else:
+        ensure_schema(engine)
@@ -6,6 +6,21 @@ db = SQLAlchemy()
 class ActiveReward(db.Model):
     """active_reward 資料表模型"""
     __tablename__ = 'active_reward'
+    __table_args__ = (
+        # 來源識別鍵：同一個試算表資料列（內容相同）只會寫入一次，重試或重播整批資料都不會重複發放
+        db.UniqueConstraint('source_spreadsheet_id', 'source_gid', 'source_row', 'source_hash', name='uq_active_reward_source'),
+        # 查詢 API（/api/rewards）依 id 由新到舊分頁（keyset）：
+        # 等值篩選（round、state、char_id、char_name、item_id、char_id + state）各有以 id 結尾的索引
+        # （InnoDB 次要索引隱含主鍵），篩選與依 id 排序都由同一個索引完成，不需要額外排序；
+        # end_time 是範圍篩選，索引只能縮小範圍，符合的資料列仍需依 id 排序（filesort）
+        db.Index('ix_active_reward_round', 'round'),
+        db.Index('ix_active_reward_char_id_state', 'char_id', 'state'),
+        db.Index('ix_active_reward_char_name', 'char_name'),
+        db.Index('ix_active_reward_item_id', 'item_id'),
+        db.Index('ix_active_reward_end_time', 'end_time'),
+        db.Index('ix_active_reward_state_id', 'state', 'id'),
+        db.Index('ix_active_reward_char_id_id', 'char_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     round = db.Column(db.Integer, nullable=True)  # 執行代號
@@ -21,6 +36,10 @@ class ActiveReward(db.Model):
     exp = db.Column(db.Integer, default=0, nullable=True)
     state = db.Column(db.Integer, default=1, nullable=True)  # 狀態 (1=已發放, 2=玩家已領取)
     end_time = db.Column(db.DateTime, nullable=True)
+    source_spreadsheet_id = db.Column(db.String(64), nullable=True)  # 來源試算表 ID
+    source_gid = db.Column(db.String(32), nullable=True)  # 來源工作表 GID
+    source_row = db.Column(db.Integer, nullable=True)  # 來源資料列行號
+    source_hash = db.Column(db.String(40), nullable=True)  # 來源資料列內容雜湊（SHA-1）
     
     def to_dict(self):
         return {
@@ -37,6 +56,9 @@ class ActiveReward(db.Model):
             'materials_count': self.materials_count,
             'exp': self.exp,
             'state': self.state,
-            'end_time': self.end_time.isoformat() if self.end_time else None
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'source_spreadsheet_id': self.source_spreadsheet_id,
+            'source_gid': self.source_gid,
+            'source_row': self.source_row
         }
 
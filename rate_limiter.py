@@ -0,0 +1,186 @@
+"""
+Google Sheets API 速率限制與重試
+
+Sheets API 的配額以「每分鐘請求數」計算（讀取、寫入分開計算），
+超過配額時回傳 429。這裡以權杖桶（token bucket）控制送出速度，
+遇到 429/5xx 時以指數退避加隨機抖動重試，並以 AIMD 方式調整速率：
+被限速時速率減半，之後每次成功逐步回升到配額上限，而不是一次退到最低速。
+"""
+from metrics import sheets_api_requests, sheets_api_seconds
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 可重試的 HTTP 狀態碼（429 超過配額、5xx 伺服器暫時錯誤）
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# 被限速後速率下限（配額上限的比例），以及每次成功回升的比例
+MIN_RATE_FRACTION = 0.1
+RATE_RECOVERY_FRACTION = 0.05
+
+class TokenBucket:
+    """權杖桶：每分鐘最多 per_minute 個請求，允許短暫突發 burst 個請求"""
+    
+    def __init__(self, per_minute, burst=None):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.configure(per_minute, burst)
+        self.tokens = float(self.capacity)
+    
+    def configure(self, per_minute, burst=None):
+        """設定配額（設定檔重新載入時可直接調整）"""
+        with self.lock:
+            self.ceiling = max(per_minute, 1) / 60.0
+            self.rate = self.ceiling
+            self.capacity = burst if burst else max(1, int(per_minute) // 10)
+    
+    def acquire(self):
+        """
+        取得一個權杖，必要時等待
+        
+        Returns:
+            float: 等待秒數
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 先預留權杖（可為負數），讓同時等待的請求依序排隊
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    def throttled(self):
+        """被限速（429）：速率減半，並清空累積的權杖"""
+        with self.lock:
+            self.rate = max(self.ceiling * MIN_RATE_FRACTION, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+    
+    def succeeded(self):
+        """請求成功：速率逐步回升到配額上限"""
+        with self.lock:
+            if self.rate < self.ceiling:
+                self.rate = min(self.ceiling, self.rate + self.ceiling * RATE_RECOVERY_FRACTION)
+    
+    @property
+    def per_minute(self):
+        return round(self.rate * 60, 1)
+
+class SheetsRateLimiter:
+    """
+    Sheets API 呼叫的速率限制與重試（程序層級共用，配額以 Google 帳號/專案計算）
+    讀取與寫入各自使用一個權杖桶
+    """
+    
+    def __init__(self, read_per_minute=60, write_per_minute=60, max_retries=5, backoff_base=1.0, backoff_max=64.0):
+        self.buckets = {
+            'read': TokenBucket(read_per_minute),
+            'write': TokenBucket(write_per_minute)
+        }
+        self.quotas = {'read': read_per_minute, 'write': write_per_minute}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.metrics = {kind: self._empty_metrics() for kind in self.buckets}
+    
+    def configure(self, read_per_minute, write_per_minute, max_retries, backoff_base, backoff_max):
+        """依設定檔更新配額與重試參數（配額沒有變更時保留目前調整後的速率）"""
+        for kind, per_minute in (('read', read_per_minute), ('write', write_per_minute)):
+            if self.quotas[kind] != per_minute:
+                self.buckets[kind].configure(per_minute)
+                self.quotas[kind] = per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+    
+    def call(self, kind, func, *args, **kwargs):
+        """
+        在速率限制下呼叫 Sheets API，遇到 429/5xx 時以指數退避加抖動重試
+        
+        Args:
+            kind: 'read' 或 'write'
+            func: gspread 方法
+        """
+        # gspread 在第一次呼叫 API 時才匯入（此時已由 GoogleSheetsService 載入）
+        from gspread.exceptions import APIError
+        bucket = self.buckets[kind]
+        method = getattr(func, '__name__', 'unknown')
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            self._record(kind, requests=1, wait_seconds=waited)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except APIError as e:
+                sheets_api_seconds.observe(time.perf_counter() - started, method=method)
+                status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+                sheets_api_requests.inc(method=method, result=str(status_code))
+                if status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    self._record(kind, failures=1)
+                    raise
+                if status_code == 429:
+                    bucket.throttled()
+                    self._record(kind, throttled=1)
+                else:
+                    self._record(kind, server_errors=1)
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self._record(kind, retries=1, backoff_seconds=delay)
+                logger.warning(f"Sheets API 回傳 {status_code}，{delay:.1f} 秒後重試（第 {attempt} 次）")
+                time.sleep(delay)
+                continue
+            sheets_api_seconds.observe(time.perf_counter() - started, method=method)
+            sheets_api_requests.inc(method=method, result='ok')
+            bucket.succeeded()
+            return result
+    
+    def stats(self):
+        """速率限制統計（累計請求數、重試次數、被限速與等待的秒數、目前速率）"""
+        with self.lock:
+            stats = {kind: dict(metrics) for kind, metrics in self.metrics.items()}
+        for kind, bucket in self.buckets.items():
+            stats[kind]['wait_seconds'] = round(stats[kind]['wait_seconds'], 3)
+            stats[kind]['backoff_seconds'] = round(stats[kind]['backoff_seconds'], 3)
+            stats[kind]['quota_per_minute'] = self.quotas[kind]
+            stats[kind]['rate_per_minute'] = bucket.per_minute
+        return stats
+    
+    def _backoff(self, attempt, error):
+        """退避秒數：有 Retry-After 時依照伺服器指示，否則為指數退避加上完整抖動（full jitter）"""
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            retry_after = float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def _record(self, kind, **counts):
+        with self.lock:
+            metrics = self.metrics[kind]
+            for name, value in counts.items():
+                metrics[name] += value
+    
+    @staticmethod
+    def _empty_metrics():
+        return {
+            'requests': 0,
+            'retries': 0,
+            'throttled': 0,
+            'server_errors': 0,
+            'failures': 0,
+            'wait_seconds': 0.0,
+            'backoff_seconds': 0.0
+        }
+
+# 程序層級的速率限制器（配額由 GoogleSheetsService 依設定檔設定）
+sheets_limiter = SheetsRateLimiter()
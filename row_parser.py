@@ -0,0 +1,146 @@
+from sheets_service import SYNC_COLUMNS
+from itertools import repeat
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 試算表欄位 -> (資料庫欄位, 轉換類型)
+# 試算表欄位：日期、執行代號、角色身分證、角色ID、道具編號、補償道具名稱、數量、已發放
+FIELD_MAP = {
+    '執行代號': ('round', 'int'),
+    '角色身分證': ('char_id', 'str'),
+    '角色ID': ('char_name', 'str'),
+    '道具編號': ('item_id', 'str'),
+    '補償道具名稱': ('item_name', 'str'),
+    '數量': ('item_count', 'int'),
+}
+
+# 必填欄位：空白時該列驗證失敗（同步欄位全部空白的資料列則直接略過）
+REQUIRED_HEADERS = ('角色身分證', '道具編號', '數量')
+
+def parse_int(value_str):
+    """解析整數字串為整數（空白回傳 None，無法解析時拋出 ValueError）"""
+    if not value_str:
+        return None
+    # 移除可能的逗號和空白
+    cleaned = str(value_str).replace(',', '').strip()
+    if not cleaned:
+        return None
+    return int(cleaned)
+
+class RowParser:
+    """
+    試算表資料列解析器
+    每次同步只解析一次標題列、建立欄位轉換表，再以「整欄」方式轉換整批資料
+    """
+    
+    def __init__(self, headers, spreadsheet_id, worksheet_gid):
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet_gid = str(worksheet_gid)
+        
+        # 標題 -> 欄位索引（重複標題以最後一個為準）
+        header_index = {header: idx for idx, header in enumerate(headers)}
+        
+        # 欄位轉換表：(資料庫欄位, 試算表欄位名稱, 欄位索引或 None, 轉換類型)
+        self.converters = [
+            (field, header, header_index.get(header), kind)
+            for header, (field, kind) in FIELD_MAP.items()
+        ]
+    
+    def parse(self, rows):
+        """
+        解析整批資料列
+        
+        Args:
+            rows: get_unconfirmed_rows 回傳的資料列（含 row_number 與 data）
+        
+        Returns:
+            tuple: (records, row_numbers, rejected, blank_rows)
+                records: 可直接用於多筆 INSERT 的欄位字典列表
+                row_numbers: 與 records 對應的行號
+                rejected: 被拒絕的資料列 [{'row_number', 'reason'}, ...]
+                blank_rows: 同步欄位全部空白的行號（不寫入、不確認，也不視為錯誤）
+        """
+        data = [row_info['data'] for row_info in rows]
+        row_count = len(data)
+        
+        # 逐欄取出與轉換，並記錄每一列的錯誤原因
+        raw_columns = {}
+        columns = []
+        errors = {}
+        for field, header, idx, kind in self.converters:
+            values = [row[idx] for row in data] if idx is not None else None
+            raw_columns[header] = values
+            if values is None:
+                columns.append([None] * row_count)
+            elif kind == 'int':
+                columns.append(self._convert_int_column(values, header, errors))
+            else:
+                columns.append(values)
+        
+        # 整列空白的資料列直接略過，其餘資料列檢查必填欄位
+        present = [values for values in raw_columns.values() if values is not None]
+        blank = set(i for i in range(row_count) if not any(str(values[i]).strip() for values in present))
+        for header in REQUIRED_HEADERS:
+            values = raw_columns.get(header)
+            for i in range(row_count):
+                if i not in blank and (values is None or not str(values[i]).strip()):
+                    errors.setdefault(i, f"缺少{header}")
+        
+        row_numbers = [row_info['row_number'] for row_info in rows]
+        hashes = self._hash_column(raw_columns, row_count)
+        
+        # 固定欄位以 repeat 併入，每列只建立一次字典
+        fields = [converter[0] for converter in self.converters]
+        fields += ['source_row', 'source_hash', 'state', 'source_spreadsheet_id', 'source_gid']
+        constants = [
+            repeat(1),  # state：1 表示已發放（系統已發放給玩家）
+            repeat(self.spreadsheet_id),
+            repeat(self.worksheet_gid)
+        ]
+        records = [dict(zip(fields, values)) for values in zip(*columns, row_numbers, hashes, *constants)]
+        
+        rejected = []
+        blank_rows = [row_numbers[i] for i in sorted(blank)]
+        if errors or blank:
+            rejected = [{'row_number': row_numbers[i], 'reason': reason} for i, reason in sorted(errors.items()) if i not in blank]
+            records = [record for i, record in enumerate(records) if i not in errors and i not in blank]
+            row_numbers = [row_number for i, row_number in enumerate(row_numbers) if i not in errors and i not in blank]
+            if rejected:
+                logger.warning(f"{len(rejected)} 列資料驗證失敗，未寫入資料庫")
+        return records, row_numbers, rejected, blank_rows
+    
+    @staticmethod
+    def _convert_int_column(values, header, errors):
+        """
+        轉換整數欄位：先以整欄快速轉換（資料乾淨時只需一次 list comprehension），
+        有空白、千分位逗號或錯誤值時才退回逐格解析
+        """
+        try:
+            return [int(value) for value in values]
+        except (ValueError, TypeError):
+            pass
+        
+        converted = []
+        for i, value in enumerate(values):
+            try:
+                converted.append(int(value))
+                continue
+            except (ValueError, TypeError):
+                pass
+            try:
+                converted.append(parse_int(value))
+            except (ValueError, TypeError):
+                converted.append(None)
+                errors.setdefault(i, f"「{header}」不是有效的整數: {value!r}")
+        return converted
+    
+    @staticmethod
+    def _hash_column(raw_columns, row_count):
+        """計算每一列同步欄位內容的 SHA-1（來源識別鍵的一部分，欄位順序固定為 SYNC_COLUMNS）"""
+        empty = [''] * row_count
+        hash_columns = [raw_columns.get(header) or empty for header in SYNC_COLUMNS]
+        sha1 = hashlib.sha1
+        join = '\x1f'.join
+        return [sha1(join(values).encode('utf-8')).hexdigest() for values in zip(*hash_columns)]
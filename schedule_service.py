@@ -0,0 +1,221 @@
+from config import get_config
+from models import db
+from migrations import schema_current
+from datetime import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 排程關閉時重新檢查設定的間隔秒數（設定檔重新載入後可直接開啟排程）
+DISABLED_POLL_INTERVAL = 30
+
+# 多個 worker 程序時只有取得此 MySQL 具名鎖的程序執行排程同步
+SCHEDULER_LOCK_NAME = 'active_reward_scheduler'
+
+class SyncScheduler:
+    """
+    程序內的排程同步（背景執行緒，透過 SyncJobManager 建立同步工作）
+    連續幾次同步都沒有讀到待處理資料時逐步拉長間隔，讀到時回到最短間隔；
+    試算表沒有變更時同步只會送出一次 Drive metadata 請求（見 GoogleSheetsService.iter_unconfirmed_pages），
+    因此閒置時的輪詢成本很低。與手動同步共用同一個工作管理器，同一工作表不會重複執行。
+    
+    SyncJobManager 的去重只在同一程序內有效，因此以 gunicorn 等多個 worker 程序執行時，
+    每個程序的排程執行緒都會嘗試取得 MySQL 具名鎖（SCHEDULER_LOCK_NAME，綁定在一條專用連線上），
+    只有取得鎖的程序執行排程同步，其他程序待命；該程序結束或連線中斷時鎖自動釋放，由其他程序接手。
+    使用 MySQL 以外的資料庫（例如 SQLite）時沒有跨程序的鎖，只能以單一程序執行。
+    資料庫遷移尚未全部套用時不執行同步；每次最多等待同步工作 SYNC_JOB_TIMEOUT 秒。
+    """
+    
+    def __init__(self, job_manager):
+        self.job_manager = job_manager
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.interval = None
+        self.next_run = None
+        self.idle_runs = 0
+        self.runs = 0
+        self.running = False
+        self.last_run = None
+        # 持有排程鎖的專用連線（非 MySQL 時不使用）
+        self.leader_conn = None
+        self.leader = False
+        # 資料庫遷移是否已全部套用（套用完成前不執行同步）
+        self.schema_ready = False
+    
+    def start(self):
+        """啟動排程執行緒（是否實際執行同步依設定檔 SYNC_SCHEDULE，可隨設定重新載入開關）"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._loop, name='sync-scheduler', daemon=True)
+            self.thread.start()
+        logger.info("排程同步執行緒已啟動")
+    
+    def run_now(self):
+        """立即執行下一次排程同步（不等待目前的間隔）"""
+        with self.lock:
+            self.next_run = time.time()
+        self.wakeup.set()
+    
+    def stats(self):
+        """排程狀態（供 /api/schedule 使用）"""
+        config = get_config()
+        with self.lock:
+            next_run = self.next_run
+            return {
+                'enabled': config.SYNC_SCHEDULE,
+                'started': self.thread is not None,
+                'leader': self.leader,
+                'schema_ready': self.schema_ready,
+                'running': self.running,
+                'interval': self.interval,
+                'interval_min': config.SYNC_INTERVAL_MIN,
+                'interval_max': config.SYNC_INTERVAL_MAX,
+                'next_run': datetime.fromtimestamp(next_run).isoformat() if next_run and config.SYNC_SCHEDULE and self.leader else None,
+                'next_run_in': round(max(0.0, next_run - time.time()), 1) if next_run and config.SYNC_SCHEDULE and self.leader else None,
+                'idle_runs': self.idle_runs,
+                'runs': self.runs,
+                'last_run': dict(self.last_run) if self.last_run else None
+            }
+    
+    def _loop(self):
+        while True:
+            config = get_config()
+            if not config.SYNC_SCHEDULE:
+                self._release_leader()
+                self.wakeup.wait(DISABLED_POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            if not self._acquire_leader():
+                # 其他程序正在執行排程，稍後再嘗試接手
+                self.wakeup.wait(max(config.SYNC_INTERVAL_MIN, DISABLED_POLL_INTERVAL))
+                self.wakeup.clear()
+                continue
+            if not self._check_schema():
+                # 資料庫遷移尚未完成（例如其他程序正在套用），稍後再確認
+                self.wakeup.wait(DISABLED_POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            
+            with self.lock:
+                if self.interval is None:
+                    self.interval = float(config.SYNC_INTERVAL_MIN)
+                # 設定變更後間隔仍需落在最短與最長間隔之間
+                self.interval = min(max(self.interval, config.SYNC_INTERVAL_MIN), config.SYNC_INTERVAL_MAX)
+                if self.next_run is None:
+                    # 啟動後立即執行第一次同步
+                    self.next_run = time.time()
+                delay = self.next_run - time.time()
+            if delay > 0:
+                # 等待期間可被 run_now 或設定變更喚醒，醒來後重新計算
+                self.wakeup.wait(min(delay, DISABLED_POLL_INTERVAL))
+                self.wakeup.clear()
+                continue
+            
+            try:
+                self._run_once(config)
+            except Exception:
+                logger.exception("排程同步失敗")
+                with self.lock:
+                    self.running = False
+                    self.next_run = time.time() + self.interval
+    
+    def _acquire_leader(self):
+        """確認（或嘗試取得）排程鎖；非 MySQL 資料庫時一律視為取得"""
+        try:
+            with self.job_manager.app.app_context():
+                engine = db.engine
+                if engine.dialect.name != 'mysql':
+                    self.leader = True
+                    return True
+                if self.leader_conn is not None:
+                    # 確認連線仍然有效且鎖仍由此連線持有
+                    held = self.leader_conn.execute(
+                        db.text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"), {'name': SCHEDULER_LOCK_NAME}
+                    ).scalar()
+                    if held == 1:
+                        return True
+                    self._release_leader()
+                conn = engine.connect()
+                acquired = conn.execute(db.text("SELECT GET_LOCK(:name, 0)"), {'name': SCHEDULER_LOCK_NAME}).scalar()
+                conn.commit()
+                if acquired != 1:
+                    conn.close()
+                    self.leader = False
+                    return False
+                self.leader_conn = conn
+                self.leader = True
+                logger.info("已取得排程鎖，此程序負責執行排程同步")
+                return True
+        except Exception as e:
+            logger.warning(f"取得排程鎖失敗: {e}")
+            self._release_leader()
+            return False
+    
+    def _check_schema(self):
+        """確認資料庫遷移都已套用（確認一次後不再查詢）；無法確認時視為尚未完成"""
+        if self.schema_ready:
+            return True
+        try:
+            with self.job_manager.app.app_context():
+                ready = schema_current(db.engine)
+        except Exception as e:
+            logger.warning(f"確認資料庫版本失敗，暫不執行排程同步: {e}")
+            return False
+        if not ready:
+            logger.warning("資料庫遷移尚未全部套用，暫不執行排程同步")
+        self.schema_ready = ready
+        return ready
+    
+    def _release_leader(self):
+        """
+        關閉持有排程鎖的連線（鎖隨連線釋放）
+        具名鎖綁定在 MySQL 連線上，歸還連線池並不會釋放，因此直接捨棄底層連線
+        """
+        conn, self.leader_conn = self.leader_conn, None
+        self.leader = False
+        if conn is not None:
+            try:
+                conn.invalidate()
+                conn.close()
+            except Exception:
+                pass
+    
+    def _run_once(self, config):
+        """執行一次同步並依結果調整下一次的間隔"""
+        with self.lock:
+            self.running = True
+        started = time.time()
+        job = self.job_manager.submit()
+        # 等待時間有上限，Sheets API 呼叫卡住時排程執行緒不會永遠停在這裡
+        job = self.job_manager.wait(job['job_id'], timeout=config.SYNC_JOB_TIMEOUT) or job
+        if job['status'] in ('queued', 'running'):
+            logger.warning(f"同步工作 {job['job_id']} 超過 {config.SYNC_JOB_TIMEOUT} 秒仍未完成，排程繼續運作")
+        
+        # 讀到待處理資料（包含驗證失敗的資料列）時回到最短間隔，否則（沒有變更、沒有資料或同步失敗）拉長間隔
+        found = job['progress']['rows_read'] > 0
+        with self.lock:
+            if found:
+                self.idle_runs = 0
+                self.interval = float(config.SYNC_INTERVAL_MIN)
+            else:
+                self.idle_runs += 1
+                self.interval = min(config.SYNC_INTERVAL_MAX, max(config.SYNC_INTERVAL_MIN, self.interval * config.SYNC_INTERVAL_BACKOFF))
+            result = job['result'] or {}
+            self.runs += 1
+            self.running = False
+            self.last_run = {
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'started_at': datetime.fromtimestamp(started).isoformat(),
+                'elapsed': round(time.time() - started, 3),
+                'rows_read': job['progress']['rows_read'],
+                'count': result.get('count', 0),
+                'unchanged': result.get('unchanged', False),
+                'message': result.get('message') or job['error']
+            }
+            self.next_run = time.time() + self.interval
+        logger.info(f"排程同步完成（{job['status']}，讀取 {job['progress']['rows_read']} 筆），{self.interval:.0f} 秒後再次同步")
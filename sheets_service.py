@@ -1,11 +1,18 @@
-import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow, Flow
-from google.auth.transport.requests import Request
-from config import Config
+# gspread、google-auth 與 google-auth-oauthlib 載入較慢，在第一次使用時才匯入（CLI 與打包後的 exe 啟動較快）
+from config import get_config
+from rate_limiter import sheets_limiter
+from snapshot_cache import SheetSnapshot
+from traffic_replay import sheets_traffic
 import logging
 import os
 import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -19,61 +26,260 @@ SCOPES = [
 # 全域變數：用於儲存 Web OAuth 流程的 state（用於回調驗證）
 _oauth_flow_state = None
 
-class GoogleSheetsService:
-    """Google Sheets 服務類別（使用個人 Google 帳號 OAuth 2.0）"""
+# 批次更新「已發放」欄位時，單次 batch_update 請求的上限（避免超過 API 請求大小限制）
+MAX_CELLS_PER_BATCH = 20000
+MAX_RANGES_PER_BATCH = 500
+
+# 同步時實際使用的欄位（加上「已發放」欄位），讀取時只下載這些欄位
+SYNC_COLUMNS = ['執行代號', '角色身分證', '角色ID', '道具編號', '補償道具名稱', '數量']
+
+# 程序層級的連線快取：(spreadsheet_id, 工作表名稱/GID) -> 已授權的 client 與工作表
+# 讓每次同步請求都能重用同一個 gspread client，避免重複授權與列出工作表
+_client_cache = {}
+# 所有工作表共用的已授權 gspread client（憑證被取代時重新建立）
+_shared_client = {'credentials': None, 'client': None}
+_client_cache_lock = threading.RLock()
+# 每個快取鍵值各自的鎖：開啟試算表與解析工作表（網路請求）時只鎖住同一工作表，
+# _client_cache_lock 只在讀寫上面兩個字典時短暫持有，其他工作表的同步不需等待
+_client_key_locks = {}
+
+# 憑證在到期前多久主動刷新；刷新失敗時多久後重試
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+CREDENTIALS_RETRY_INTERVAL = 60
+
+# Drive 檔案 metadata（用於取得試算表的修訂版本）
+DRIVE_FILE_URL = 'https://www.googleapis.com/drive/v3/files/{}'
+
+# 讀取類的工作表方法（其餘方法以寫入配額計算）
+READ_METHODS = {'row_values', 'col_values', 'batch_get', 'get', 'get_all_values', 'get_values'}
+
+# 增量讀取狀態檔（sync_state.json）的寫入鎖
+_read_state_lock = threading.Lock()
+
+def source_key(source):
+    """工作表的識別鍵：(spreadsheet_id, 工作表名稱或 GID)，用於連線快取與同步互斥"""
+    worksheet_key = source.get('worksheet_name', '') or source.get('worksheet_gid', '')
+    return (source['spreadsheet_id'], str(worksheet_key))
+
+def _utcnow():
+    """目前的 UTC 時間（不含時區，與 google-auth 的 creds.expiry 相同；datetime.utcnow 在 Python 3.12 起已棄用）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _client_key_lock(key):
+    """取得快取鍵值對應的鎖（第一次使用時建立）"""
+    with _client_cache_lock:
+        return _client_key_locks.setdefault(key, threading.Lock())
+
+class CredentialCache:
+    """
+    程序層級的 OAuth 憑證快取
+    所有同步請求共用同一個憑證物件，背景執行緒在到期前主動刷新；
+    刷新以鎖保護（同時多個同步只會觸發一次刷新），令牌有變更時才以暫存檔 + 取代的方式寫回 token.json
+    """
     
-    def __init__(self):
-        self.config = Config()
-        self.client = None
-        self.spreadsheet = None
-        self.worksheet = None
-        self._connect()
+    def __init__(self, refresh_margin=CREDENTIALS_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.credentials = None
+        self.token_file = None
+        # 最後一次寫入（或載入）的令牌內容，用於判斷是否需要寫回
+        self.saved_json = None
+        self.wakeup = threading.Event()
+        self.refresher = None
     
-    def _get_credentials(self):
+    def get(self, token_file, authorize):
         """
-        取得 OAuth 2.0 憑證
-        如果已有儲存的令牌，使用它；否則進行授權流程
-        """
-        creds = None
-        token_file = Path(self.config.GOOGLE_SHEETS_TOKEN_FILE)
-        
-        # 檢查是否已有儲存的令牌
-        if token_file.exists():
-            try:
-                creds = Credentials.from_authorized_user_file(str(token_file), SCOPES)
-                logger.info("從檔案載入已儲存的憑證")
-            except Exception as e:
-                logger.warning(f"載入已儲存的憑證失敗: {e}")
-                creds = None
+        取得有效的憑證
         
-        # 如果沒有憑證或憑證已過期
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                # 嘗試刷新令牌
+        Args:
+            token_file: token.json 路徑
+            authorize: 沒有可用憑證時呼叫的授權函式（回傳新的憑證）
+        """
+        token_file = str(token_file)
+        with self.lock:
+            if self.credentials is None or self.token_file != token_file:
+                self.credentials = self._load(token_file)
+                self.token_file = token_file
+            
+            creds = self.credentials
+            if creds and self._expiring(creds) and creds.refresh_token:
                 try:
-                    logger.info("令牌已過期，正在刷新...")
-                    creds.refresh(Request())
-                    logger.info("令牌刷新成功")
+                    self._refresh(creds)
                 except Exception as e:
-                    logger.warning(f"刷新令牌失敗: {e}，需要重新授權")
-                    creds = None
+                    # 提前刷新失敗時，令牌若仍有效就繼續使用（由背景執行緒稍後重試），只有已失效才重新授權
+                    if creds.valid:
+                        logger.warning(f"刷新令牌失敗: {e}，目前的令牌仍有效，稍後重試")
+                    else:
+                        logger.warning(f"刷新令牌失敗: {e}，需要重新授權")
+                        creds = None
             
             # 如果仍然沒有有效的憑證，進行授權流程
             if not creds or not creds.valid:
                 logger.info("需要進行 OAuth 2.0 授權流程")
-                creds = self._authorize()
-        
-        # 儲存憑證供下次使用
-        if creds and creds.valid:
-            try:
-                with open(token_file, 'w', encoding='utf-8') as token:
-                    token.write(creds.to_json())
-                logger.info(f"憑證已儲存到: {token_file}")
-            except Exception as e:
-                logger.warning(f"儲存憑證失敗: {e}")
+                creds = authorize()
+                self.credentials = creds
+                self._save(creds)
         
+        self._start_refresher()
         return creds
     
+    def set(self, creds, token_file):
+        """儲存新取得的憑證（例如 Web OAuth 回調後），取代快取中的憑證"""
+        with self.lock:
+            self.credentials = creds
+            self.token_file = str(token_file)
+            self._save(creds)
+        self.wakeup.set()
+        self._start_refresher()
+    
+    def invalidate(self):
+        """清除快取中的憑證，下次取得時重新從 token.json 載入"""
+        with self.lock:
+            self.credentials = None
+            self.saved_json = None
+    
+    def _load(self, token_file):
+        """從 token.json 載入憑證（呼叫端需持有 self.lock）"""
+        self.saved_json = None
+        if not Path(token_file).exists():
+            return None
+        try:
+            from google.oauth2.credentials import Credentials
+            creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+            self.saved_json = creds.to_json()
+            logger.info("從檔案載入已儲存的憑證")
+            return creds
+        except Exception as e:
+            logger.warning(f"載入已儲存的憑證失敗: {e}")
+            return None
+    
+    def _expiring(self, creds):
+        """憑證無效或即將到期（google-auth 的 expiry 為不含時區的 UTC 時間）"""
+        if not creds.valid:
+            return True
+        return creds.expiry is not None and creds.expiry - _utcnow() <= self.refresh_margin
+    
+    def _refresh(self, creds):
+        """刷新令牌並寫回 token.json（呼叫端需持有 self.lock；快取中的 client 共用同一個憑證物件，會直接使用新令牌）"""
+        from google.auth.transport.requests import Request
+        logger.info("令牌即將到期，正在刷新...")
+        creds.refresh(Request())
+        self._save(creds)
+        logger.info("令牌刷新成功")
+    
+    def _save(self, creds):
+        """令牌有變更時才寫回 token.json（先寫入暫存檔再取代，避免多個程序同時寫入時產生不完整的檔案）"""
+        if not creds or not creds.valid:
+            return
+        data = creds.to_json()
+        if data == self.saved_json:
+            return
+        try:
+            token_file = Path(self.token_file)
+            token_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=str(token_file.parent), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, token_file)
+            self.saved_json = data
+            logger.info(f"憑證已儲存到: {token_file}")
+        except Exception as e:
+            logger.warning(f"儲存憑證失敗: {e}")
+    
+    def _start_refresher(self):
+        """啟動背景刷新執行緒（只會啟動一次）"""
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, name='credentials-refresher', daemon=True)
+        self.refresher.start()
+    
+    def _refresh_loop(self):
+        """在到期前 refresh_margin 刷新令牌；刷新失敗時每隔 CREDENTIALS_RETRY_INTERVAL 秒重試"""
+        while True:
+            wait = self._seconds_until_refresh()
+            if wait <= 0:
+                with self.lock:
+                    creds = self.credentials
+                    if creds is not None and creds.refresh_token and self._expiring(creds):
+                        try:
+                            self._refresh(creds)
+                        except Exception as e:
+                            logger.warning(f"背景刷新令牌失敗，{CREDENTIALS_RETRY_INTERVAL} 秒後重試: {e}")
+                wait = self._seconds_until_refresh()
+                if wait <= 0:
+                    wait = CREDENTIALS_RETRY_INTERVAL
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+    
+    def _seconds_until_refresh(self):
+        """距離下次需要刷新的秒數（沒有憑證或沒有到期時間時，每隔 CREDENTIALS_RETRY_INTERVAL 秒檢查一次）"""
+        with self.lock:
+            creds = self.credentials
+            if creds is None or creds.expiry is None:
+                return CREDENTIALS_RETRY_INTERVAL
+            return (creds.expiry - self.refresh_margin - _utcnow()).total_seconds()
+
+# 程序層級的憑證快取（所有 GoogleSheetsService 共用）
+_credential_cache = CredentialCache()
+
+class GoogleSheetsService:
+    """Google Sheets 服務類別（使用個人 Google 帳號 OAuth 2.0）"""
+    
+    def __init__(self, source=None, read_only=False):
+        """
+        Args:
+            source: 要連接的工作表（{'spreadsheet_id', 'worksheet_name', 'worksheet_gid'}），
+                    未指定時使用設定檔最上層的 SPREADSHEET_ID / WORKSHEET_NAME / WORKSHEET_GID
+            read_only: 只讀取（試執行用）：不使用快照、不更新增量讀取的高水位
+        """
+        self.config = get_config()
+        if source is None:
+            source = {
+                'spreadsheet_id': self.config.SPREADSHEET_ID,
+                'worksheet_name': self.config.WORKSHEET_NAME,
+                'worksheet_gid': self.config.WORKSHEET_GID
+            }
+        self.spreadsheet_id = source['spreadsheet_id']
+        self.worksheet_name = source.get('worksheet_name', '')
+        self.worksheet_gid = source.get('worksheet_gid', '')
+        self.read_only = read_only
+        self.client = None
+        self.spreadsheet = None
+        self.worksheet = None
+        # 最近一次讀取的範圍與其中未確認的行號，用於確認後推進高水位
+        # （讀取與確認可能在不同執行緒同時進行，以 _scan_lock 保護）
+        self._last_scan = None
+        self._scan_lock = threading.Lock()
+        # 本地快照：修訂沒有變更時略過讀取（unchanged），並略過內容未變更且已被拒絕的資料列（skipped）
+        self._snapshot = SheetSnapshot(self.config.SNAPSHOT_FILE) if self.config.SNAPSHOT_CACHE and not read_only else None
+        self.unchanged = False
+        self.skipped = 0
+        sheets_limiter.configure(
+            self.config.SHEETS_READ_QUOTA,
+            self.config.SHEETS_WRITE_QUOTA,
+            self.config.SHEETS_MAX_RETRIES,
+            self.config.SHEETS_BACKOFF_BASE,
+            self.config.SHEETS_BACKOFF_MAX
+        )
+        if sheets_traffic.configure(
+            self.config.SHEETS_TRAFFIC_MODE,
+            self.config.SHEETS_TRAFFIC_FILE,
+            self.config.SHEETS_REPLAY_SPEED
+        ):
+            GoogleSheetsService.clear_client_cache()
+        self._connect()
+    
+    def _get_credentials(self):
+        """
+        取得 OAuth 2.0 憑證
+        從程序層級的憑證快取取得（第一次使用時載入 token.json）；沒有可用的憑證時進行授權流程
+        重播模式使用匿名憑證，不需要 token.json
+        """
+        if sheets_traffic.replaying:
+            return sheets_traffic.credentials()
+        return _credential_cache.get(self.config.GOOGLE_SHEETS_TOKEN_FILE, self._authorize)
+    
     def _authorize(self):
         """
         執行 OAuth 2.0 授權流程
@@ -119,6 +325,7 @@ class GoogleSheetsService:
         # 對於本地開發，即使憑證檔案是 web 類型，也使用 InstalledAppFlow
         # 因為 InstalledAppFlow 會自動處理 localhost 回調
         # 但需要將 web 類型的憑證轉換為 installed 格式
+        from google_auth_oauthlib.flow import InstalledAppFlow
         
         try:
             # 讀取憑證檔案
@@ -196,6 +403,7 @@ class GoogleSheetsService:
     
     def _authorize_desktop(self, client_secrets_file):
         """桌面應用程式 OAuth 流程（本地開發）"""
+        from google_auth_oauthlib.flow import InstalledAppFlow
         flow = InstalledAppFlow.from_client_secrets_file(
             str(client_secrets_file),
             SCOPES
@@ -238,6 +446,7 @@ class GoogleSheetsService:
         Returns:
             tuple: (flow, authorization_url, state)
         """
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_secrets_file(
             str(client_secrets_file),
             SCOPES,
@@ -264,6 +473,7 @@ class GoogleSheetsService:
             authorization_response: 授權回應 URL（從 request.url 取得）
             state: OAuth state（從 session 取得，用於驗證）
         """
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_secrets_file(
             str(client_secrets_file),
             SCOPES,
@@ -274,34 +484,61 @@ class GoogleSheetsService:
         flow.fetch_token(authorization_response=authorization_response)
         return flow.credentials
     
+    @classmethod
+    def clear_client_cache(cls):
+        """清除程序層級的連線快取（例如重新授權後）"""
+        with _client_cache_lock:
+            _client_cache.clear()
+            _shared_client['credentials'] = None
+            _shared_client['client'] = None
+        logger.info("已清除 Google Sheets 連線快取")
+    
+    @classmethod
+    def store_credentials(cls, creds, token_file):
+        """儲存 Web OAuth 流程取得的憑證，並丟棄使用舊憑證建立的快取連線"""
+        _credential_cache.set(creds, token_file)
+        cls.clear_client_cache()
+    
+    def _cache_key(self):
+        """連線快取的鍵值：(spreadsheet_id, 工作表名稱或 GID)"""
+        return source_key({
+            'spreadsheet_id': self.spreadsheet_id,
+            'worksheet_name': self.worksheet_name,
+            'worksheet_gid': self.worksheet_gid
+        })
+    
     def _connect(self):
-        """連接到 Google Sheets"""
+        """連接到 Google Sheets（優先重用程序層級快取中的連線）"""
+        import gspread
         try:
-            # 使用 OAuth 2.0 憑證
+            key = self._cache_key()
+            # 使用 OAuth 2.0 憑證（可能需要刷新令牌或進行授權流程，不可持有快取鎖）
             creds = self._get_credentials()
-            self.client = gspread.authorize(creds)
-            self.spreadsheet = self.client.open_by_key(self.config.SPREADSHEET_ID)
+            with _client_cache_lock:
+                # 快取中的憑證被取代時（例如重新授權）重新建立 client
+                if _shared_client['credentials'] is not creds:
+                    _shared_client['client'] = sheets_traffic.attach(gspread.authorize(creds))
+                    _shared_client['credentials'] = creds
+                client = _shared_client['client']
             
-            # 優先根據工作表名稱查找
-            if hasattr(self.config, 'WORKSHEET_NAME') and self.config.WORKSHEET_NAME:
-                for sheet in self.spreadsheet.worksheets():
-                    if sheet.title == self.config.WORKSHEET_NAME:
-                        self.worksheet = sheet
-                        logger.info(f"根據名稱找到工作表: {self.config.WORKSHEET_NAME}")
-                        break
-            
-            # 如果根據名稱找不到，嘗試根據 GID 查找
-            if not self.worksheet and hasattr(self.config, 'WORKSHEET_GID') and self.config.WORKSHEET_GID:
-                for sheet in self.spreadsheet.worksheets():
-                    if str(sheet.id) == str(self.config.WORKSHEET_GID):
-                        self.worksheet = sheet
-                        logger.info(f"根據 GID 找到工作表: {self.config.WORKSHEET_GID}")
-                        break
-            
-            # 如果都找不到，使用第一個工作表
-            if not self.worksheet:
-                self.worksheet = self.spreadsheet.sheet1
-                logger.warning(f"找不到指定名稱或 GID 的工作表，使用第一個工作表: {self.worksheet.title}")
+            with _client_key_lock(key):
+                with _client_cache_lock:
+                    entry = _client_cache.get(key)
+                if entry is None or entry['client'] is not client:
+                    entry = {
+                        'client': client,
+                        'spreadsheet': self._open_spreadsheet(client),
+                        'worksheet': None
+                    }
+                    with _client_cache_lock:
+                        _client_cache[key] = entry
+                
+                if entry['worksheet'] is None:
+                    entry['worksheet'] = self._resolve_worksheet(entry['spreadsheet'])
+                
+                self.client = entry['client']
+                self.spreadsheet = entry['spreadsheet']
+                self.worksheet = entry['worksheet']
             
             logger.info(f"成功連接到 Google Sheets: {self.worksheet.title}")
             
@@ -309,50 +546,406 @@ class GoogleSheetsService:
             logger.error(f"連接 Google Sheets 失敗: {str(e)}")
             raise
     
-    def get_unconfirmed_rows(self):
+    def _open_spreadsheet(self, client):
+        """開啟試算表（同一試算表的其他工作表已開啟時直接共用）"""
+        with _client_cache_lock:
+            for (spreadsheet_id, _), entry in _client_cache.items():
+                if spreadsheet_id == self.spreadsheet_id and entry['client'] is client:
+                    return entry['spreadsheet']
+        return sheets_limiter.call('read', client.open_by_key, self.spreadsheet_id)
+    
+    def _resolve_worksheet(self, spreadsheet):
+        """根據設定的名稱或 GID 找到工作表（只列出一次工作表清單）"""
+        worksheet = None
+        sheets = sheets_limiter.call('read', spreadsheet.worksheets)
+        
+        # 優先根據工作表名稱查找
+        if self.worksheet_name:
+            for sheet in sheets:
+                if sheet.title == self.worksheet_name:
+                    worksheet = sheet
+                    logger.info(f"根據名稱找到工作表: {self.worksheet_name}")
+                    break
+        
+        # 如果根據名稱找不到，嘗試根據 GID 查找
+        if not worksheet and self.worksheet_gid:
+            for sheet in sheets:
+                if str(sheet.id) == str(self.worksheet_gid):
+                    worksheet = sheet
+                    logger.info(f"根據 GID 找到工作表: {self.worksheet_gid}")
+                    break
+        
+        # 如果都找不到，使用第一個工作表
+        if not worksheet:
+            worksheet = sheets[0] if sheets else spreadsheet.sheet1
+            logger.warning(f"找不到指定名稱或 GID 的工作表，使用第一個工作表: {worksheet.title}")
+        
+        return worksheet
+    
+    def _worksheet_call(self, method_name, *args, **kwargs):
+        """
+        呼叫工作表方法（經過速率限制，429/5xx 會自動退避重試）；
+        遇到 404/權限錯誤（工作表被刪除、改名或權限變更）時
+        重新解析工作表並重試一次，其餘情況直接使用快取中的工作表
+        """
+        from gspread.exceptions import APIError, WorksheetNotFound
+        kind = 'read' if method_name in READ_METHODS else 'write'
+        try:
+            return sheets_limiter.call(kind, getattr(self.worksheet, method_name), *args, **kwargs)
+        except (APIError, WorksheetNotFound) as e:
+            response = getattr(e, 'response', None)
+            status_code = getattr(response, 'status_code', None)
+            if isinstance(e, APIError) and status_code not in (403, 404):
+                raise
+            logger.warning(f"工作表存取失敗（{status_code}），重新解析工作表: {e}")
+            key = self._cache_key()
+            with _client_key_lock(key):
+                with _client_cache_lock:
+                    entry = _client_cache.get(key)
+                if entry is not None:
+                    # 保留已授權的 client，只重新開啟試算表並重新解析工作表
+                    entry['spreadsheet'] = sheets_limiter.call('read', entry['client'].open_by_key, self.spreadsheet_id)
+                    entry['worksheet'] = None
+            self._connect()
+            return sheets_limiter.call(kind, getattr(self.worksheet, method_name), *args, **kwargs)
+    
+    def get_unconfirmed_rows(self, full_scan=False):
         """
         取得未確認的資料列（「已發放」欄位為空白的資料）
         只處理空白欄位，跳過已有 V 或其他文字的資料
         假設第一列是標題，第二列開始是資料
         需要根據實際試算表結構調整欄位索引
+        
+        啟用增量讀取（INCREMENTAL_READ）時，只讀取高水位之後的資料列；
+        標題列改變、超過 FULL_RESCAN_INTERVAL 或 full_scan=True 時改為完整掃描
+        """
+        unconfirmed_rows = []
+        headers, confirmed_col_idx = [], None
+        pages = self.iter_unconfirmed_pages(full_scan=full_scan, page_size=self.config.SYNC_PAGE_SIZE)
+        for page_rows, headers, confirmed_col_idx in pages:
+            unconfirmed_rows.extend(page_rows)
+        self.save_high_water_mark()
+        return unconfirmed_rows, headers, confirmed_col_idx
+    
+    def iter_unconfirmed_pages(self, full_scan=False, page_size=None):
+        """
+        逐頁讀取未確認的資料列，每讀完一頁就交給呼叫端處理（讀取與後續寫入可以重疊進行）
+        工作表 row_count 範圍內的分頁以 SYNC_READ_WORKERS 個執行緒同時下載，仍依行號順序交給呼叫端；
+        超過 row_count 的部分（讀取期間才新增的資料列）再逐頁讀取直到沒有資料；row_count 在讀取前重新取得
+        
+        Args:
+            full_scan: 忽略高水位，從第 2 行開始完整掃描
+            page_size: 每頁的列數；None 表示以單一開放範圍讀取到最後一列
+        
+        Yields:
+            tuple: (該頁未確認的資料列, headers, confirmed_col_idx)
         """
         try:
-            all_values = self.worksheet.get_all_values()
-            if not all_values or len(all_values) < 2:
-                return [], [], None
-            
-            headers = all_values[0]
+            # 啟用快照時先以一次 Drive metadata 請求確認試算表是否有變更
+            revision = self._fetch_revision() if self._snapshot is not None else None
+            if revision is not None and not full_scan and revision == self._snapshot.get_revision(self._state_key()):
+                logger.info(f"試算表沒有變更（修訂 {revision}），略過讀取")
+                self.unchanged = True
+                return
             
-            # 找到「已發放」欄位的索引（確認欄位）
-            confirmed_col_idx = None
-            for idx, header in enumerate(headers):
-                if '已發放' in header or 'issued' in header.lower() or 'confirmed' in header.lower():
-                    confirmed_col_idx = idx
-                    break
+            start_row, headers, confirmed_col_idx, col_ranges = self._prepare_read(full_scan)
             
             if confirmed_col_idx is None:
-                logger.warning("找不到「已發放」欄位，無法判斷哪些資料需要處理")
+                if headers:
+                    logger.warning("找不到「已發放」欄位，無法判斷哪些資料需要處理")
                 # 如果找不到確認欄位，返回空列表（避免誤處理）
-                return [], headers, None
+                yield [], headers, None
+                return
             
-            unconfirmed_rows = []
-            for row_idx, row in enumerate(all_values[1:], start=2):  # start=2 因為第一列是標題
-                if len(row) > confirmed_col_idx:
-                    confirmed_value = row[confirmed_col_idx].strip()
-                    # 只處理「已發放」欄位為空白的資料（跳過已有 V 或其他文字的資料）
-                    if not confirmed_value or confirmed_value == '':
-                        unconfirmed_rows.append({
-                            'row_number': row_idx,
-                            'data': row,
-                            'confirmed_col_idx': confirmed_col_idx
-                        })
+            scan = {
+                'start_row': start_row,
+                'end_row': start_row - 1,
+                'unconfirmed': set(),
+                'header_checksum': self._header_checksum(headers),
+                'full_scan': start_row == 2
+            }
+            with self._scan_lock:
+                self._last_scan = scan
+            if self._snapshot is not None and self._snapshot.get_header_checksum(self._state_key()) != scan['header_checksum']:
+                self._snapshot.reset(self._state_key(), scan['header_checksum'])
+            
+            total_rows = 0
+            total_unconfirmed = 0
+            total_yielded = 0
+            for page_start, page_end, rows in self._iter_pages(col_ranges, len(headers), start_row, page_size):
+                unconfirmed_rows = []
+                for row_idx, row in enumerate(rows, start=page_start):  # 第一列是標題，資料從 start_row 開始
+                    if len(row) > confirmed_col_idx:
+                        confirmed_value = row[confirmed_col_idx].strip()
+                        # 只處理「已發放」欄位為空白的資料（跳過已有 V 或其他文字的資料）
+                        if not confirmed_value or confirmed_value == '':
+                            unconfirmed_rows.append({
+                                'row_number': row_idx,
+                                'data': row,
+                                'confirmed_col_idx': confirmed_col_idx
+                            })
+                
+                # 頁尾的空白列會被 API 省略；還沒到工作表最後一列時，下一頁仍可能有資料
+                # （整頁都是空白列時 rows 為空，但之後仍可能有資料，不能因此停止）
+                has_more = (
+                    page_size is not None and
+                    (page_end < self.worksheet.row_count or len(rows) == page_size)
+                )
+                with self._scan_lock:
+                    scan['end_row'] = page_end if has_more else page_start + len(rows) - 1
+                    scan['unconfirmed'].update(row_info['row_number'] for row_info in unconfirmed_rows)
+                total_rows += len(rows)
+                total_unconfirmed += len(unconfirmed_rows)
+                unconfirmed_rows = self._skip_settled(unconfirmed_rows)
+                total_yielded += len(unconfirmed_rows)
+                
+                yield unconfirmed_rows, headers, confirmed_col_idx
+                
+                if not has_more:
+                    break
             
-            return unconfirmed_rows, headers, confirmed_col_idx
+            logger.info(f"讀取第 {start_row} 行之後的 {total_rows} 列資料，{total_unconfirmed} 列未確認")
+            # 沒有任何需要處理的資料列時才記錄修訂：有資料列送出時，寫回「已發放」會改變修訂，
+            # 寫入失敗的資料列也需要在下次同步重試，因此留待下次讀取確認沒有待處理資料後再記錄
+            if revision is not None and total_yielded == 0:
+                self._snapshot.set_revision(self._state_key(), revision)
             
         except Exception as e:
             logger.error(f"讀取 Google Sheets 資料失敗: {str(e)}")
             raise
     
+    def _fetch_revision(self):
+        """
+        取得試算表的修訂（Drive 的 version 與 modifiedTime）；失敗時回傳 None（照常讀取）
+        使用快取中 gspread client 的已授權 session（不另外建立連線），並與其他 API 呼叫一樣經過速率限制與退避重試
+        """
+        try:
+            # gspread 6 的 HTTP 請求位於 client.http_client，較舊版本位於 client；非 2xx 回應會拋出 APIError
+            http_client = getattr(self.client, 'http_client', self.client)
+            
+            def drive_files_get():
+                return http_client.request(
+                    'get',
+                    DRIVE_FILE_URL.format(self.spreadsheet_id),
+                    params={'fields': 'version,modifiedTime', 'supportsAllDrives': 'true'}
+                ).json()
+            
+            metadata = sheets_limiter.call('read', drive_files_get)
+            return f"{metadata.get('version')}:{metadata.get('modifiedTime')}"
+        except Exception as e:
+            logger.warning(f"取得試算表修訂失敗，改為直接讀取: {e}")
+            return None
+    
+    def _skip_settled(self, unconfirmed_rows):
+        """與快照比對，略過內容沒有變更且上次已被驗證拒絕的資料列"""
+        if self._snapshot is None or not unconfirmed_rows:
+            return unconfirmed_rows
+        join = '\x1f'.join
+        row_hashes = {
+            row_info['row_number']: hashlib.sha1(join(row_info['data']).encode('utf-8')).hexdigest()
+            for row_info in unconfirmed_rows
+        }
+        try:
+            settled = self._snapshot.diff(self._state_key(), row_hashes)
+        except Exception as e:
+            logger.warning(f"比對試算表快照失敗，處理所有未確認的資料列: {e}")
+            return unconfirmed_rows
+        if not settled:
+            return unconfirmed_rows
+        self.skipped += len(settled)
+        self.release_rows(settled)
+        return [row_info for row_info in unconfirmed_rows if row_info['row_number'] not in settled]
+    
+    def mark_rejected(self, row_numbers):
+        """記錄驗證失敗的資料列；內容沒有變更前，之後的同步不會再處理這些資料列"""
+        self.release_rows(row_numbers)
+        if self._snapshot is not None and row_numbers:
+            try:
+                self._snapshot.mark_rejected(self._state_key(), row_numbers)
+            except Exception as e:
+                logger.warning(f"記錄驗證失敗的資料列失敗: {e}")
+    
+    def release_rows(self, row_numbers):
+        """
+        不讓這些未確認的資料列阻擋高水位（驗證失敗、空白或內容未變更而略過的資料列）
+        這些資料列不會被確認，若計入高水位，之後每次同步都會從它們開始重新讀取；
+        改為在定期完整掃描（FULL_RESCAN_INTERVAL）時重新檢查
+        """
+        with self._scan_lock:
+            if self._last_scan is not None:
+                self._last_scan['unconfirmed'].difference_update(row_numbers)
+    
+    def _iter_pages(self, col_ranges, width, start_row, page_size):
+        """
+        依序產生 (page_start, page_end, rows)，呼叫端決定何時停止
+        已知存在的分頁（row_count 以內）最多同時預先下載 SYNC_READ_WORKERS 頁，
+        之後的分頁在前一頁讀滿時才下載
+        """
+        if not page_size:
+            yield start_row, None, self._fetch_columns(col_ranges, width, start_row)
+            return
+        
+        row_count = self.worksheet.row_count
+        workers = max(1, self.config.SYNC_READ_WORKERS)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheet-read')
+        pending = deque()
+        next_start = start_row
+        try:
+            while True:
+                # 預先下載 row_count 以內的分頁；沒有待下載的分頁時至少再讀一頁
+                while len(pending) < workers and (next_start <= row_count or not pending):
+                    page_end = next_start + page_size - 1
+                    future = executor.submit(self._fetch_columns, col_ranges, width, next_start, page_end)
+                    pending.append((next_start, page_end, future))
+                    next_start = page_end + 1
+                    if next_start > row_count:
+                        break
+                page_start, page_end, future = pending.popleft()
+                yield page_start, page_end, future.result()
+        finally:
+            # 呼叫端提前停止時取消尚未開始的下載
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def _find_confirmed_col_idx(headers):
+        """找到「已發放」欄位的索引，找不到時回傳 None"""
+        for idx, header in enumerate(headers):
+            if '已發放' in header or 'issued' in header.lower() or 'confirmed' in header.lower():
+                return idx
+        return None
+    
+    def _prepare_read(self, full_scan):
+        """
+        決定讀取起點並讀取標題列
+        只下載同步需要的欄位（SYNC_COLUMNS 與「已發放」欄位），相鄰欄位合併為一個範圍
+        
+        Returns:
+            tuple: (start_row, headers, confirmed_col_idx, col_ranges)
+        """
+        state = self._load_read_state()
+        start_row = 2
+        if not full_scan and self._can_read_incrementally(state):
+            start_row = state['high_water_mark'] + 1
+        
+        headers = self._worksheet_call('row_values', 1)
+        self._refresh_row_count()
+        
+        if start_row > 2 and self._header_checksum(headers) != state.get('header_checksum'):
+            logger.info("標題列已變更，改為完整掃描")
+            start_row = 2
+        
+        confirmed_col_idx = self._find_confirmed_col_idx(headers) if headers else None
+        if confirmed_col_idx is None:
+            return start_row, headers, None, None
+        
+        wanted = set(idx for idx, header in enumerate(headers) if header in SYNC_COLUMNS)
+        wanted.add(confirmed_col_idx)
+        return start_row, headers, confirmed_col_idx, self._coalesce_ranges(wanted)
+    
+    def _refresh_row_count(self):
+        """
+        重新取得工作表屬性（row_count）：工作表物件在程序內快取，第一次連線後新增的資料列不在快取的 row_count 內，
+        分頁規劃（_iter_pages 的平行預先下載與是否還有下一頁）需要目前的列數；每次讀取前只呼叫一次，不含儲存格資料
+        失敗時沿用快取的 row_count（超過的部分仍會逐頁讀取）
+        """
+        try:
+            metadata = sheets_limiter.call('read', self.spreadsheet.fetch_sheet_metadata, {'fields': 'sheets.properties'})
+            for sheet in metadata.get('sheets', []):
+                properties = sheet.get('properties', {})
+                if properties.get('sheetId') == self.worksheet.id:
+                    self.worksheet._properties.update(properties)
+                    break
+        except Exception as e:
+            logger.warning(f"重新取得工作表列數失敗，沿用快取的列數: {e}")
+    
+    def _fetch_columns(self, col_ranges, width, start_row, end_row=None):
+        """
+        以單一 batch_get 讀取指定欄位範圍（例如 B2:B、D2:H），於本地組回資料列
+        end_row 為 None 時使用開放結尾，讀到最後一列
+        
+        Returns:
+            list: 資料列，每一列都與標題列等長，未下載的欄位為空字串
+        """
+        end = end_row if end_row is not None else ''
+        ranges = [
+            f"{self._number_to_column_letter(first + 1)}{start_row}:{self._number_to_column_letter(last + 1)}{end}"
+            for first, last in col_ranges
+        ]
+        results = self._worksheet_call('batch_get', ranges)
+        
+        # 各範圍會省略尾端的空白列與空白儲存格，以最長的範圍決定列數並補齊
+        row_count = max((len(values) for values in results), default=0)
+        rows = [[''] * width for _ in range(row_count)]
+        for (first, last), values in zip(col_ranges, results):
+            for row, row_values in zip(rows, values):
+                row[first:first + len(row_values)] = row_values
+        return rows
+    
+    def _state_key(self):
+        """增量讀取狀態的鍵值（試算表 ID + 工作表 GID）"""
+        return f"{self.spreadsheet_id}:{self.worksheet.id}"
+    
+    @staticmethod
+    def _header_checksum(headers):
+        """標題列的檢查碼，用於偵測欄位順序或名稱變更"""
+        return hashlib.sha1('\t'.join(headers).encode('utf-8')).hexdigest()
+    
+    def _load_read_state(self):
+        """讀取此工作表的增量讀取狀態"""
+        state_file = Path(self.config.SYNC_STATE_FILE)
+        if not state_file.exists():
+            return {}
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get(self._state_key(), {})
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"讀取增量同步狀態失敗，改為完整掃描: {e}")
+            return {}
+    
+    def _can_read_incrementally(self, state):
+        """判斷是否可以只讀取高水位之後的資料"""
+        if not self.config.INCREMENTAL_READ or not state.get('high_water_mark'):
+            return False
+        interval = self.config.FULL_RESCAN_INTERVAL
+        return interval > 0 and time.time() - state.get('last_full_scan', 0) < interval
+    
+    def save_high_water_mark(self):
+        """
+        根據最近一次讀取的結果計算並儲存高水位：
+        第一個等待確認的資料列之前的最後一行（之前的資料列都已確認或已略過）
+        每次同步結束時呼叫一次（update_confirmations 只更新記憶體中的結果，不寫入狀態檔）
+        """
+        with self._scan_lock:
+            scan = self._last_scan
+            if scan is None or not self.config.INCREMENTAL_READ or self.read_only:
+                return
+            if scan['unconfirmed']:
+                high_water_mark = min(scan['unconfirmed']) - 1
+            else:
+                high_water_mark = scan['end_row']
+        
+        try:
+            with _read_state_lock:
+                state_file = Path(self.config.SYNC_STATE_FILE)
+                all_states = {}
+                if state_file.exists():
+                    with open(state_file, 'r', encoding='utf-8') as f:
+                        all_states = json.load(f)
+                previous = all_states.get(self._state_key(), {})
+                all_states[self._state_key()] = {
+                    'high_water_mark': max(high_water_mark, scan['start_row'] - 1),
+                    'header_checksum': scan['header_checksum'],
+                    'last_full_scan': time.time() if scan['full_scan'] else previous.get('last_full_scan', 0)
+                }
+                # 先寫入暫存檔再取代，避免寫到一半的狀態檔
+                state_file.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=str(state_file.parent), suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(all_states, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, state_file)
+        except Exception as e:
+            logger.warning(f"儲存增量同步狀態失敗: {e}")
+    
     def update_confirmation(self, row_number, confirmed_col_idx):
         """
         更新指定列的「已發放」欄位為 V
@@ -362,7 +955,7 @@ class GoogleSheetsService:
                 # 使用 A1 表示法更新儲存格（row_number 是實際行號，confirmed_col_idx+1 是欄位編號）
                 col_letter = self._number_to_column_letter(confirmed_col_idx + 1)
                 cell_address = f"{col_letter}{row_number}"
-                self.worksheet.update(cell_address, 'V')
+                self._worksheet_call('update', cell_address, 'V')
                 logger.info(f"已更新第 {row_number} 行的「已發放」欄位為 V")
             else:
                 logger.warning("找不到「已發放」欄位，無法更新")
@@ -370,6 +963,79 @@ class GoogleSheetsService:
             logger.error(f"更新「已發放」欄位失敗: {str(e)}")
             raise
     
+    def update_confirmations(self, row_numbers, confirmed_col_idx):
+        """
+        批次更新多列的「已發放」欄位為 V
+        連續的行號會合併為單一範圍（例如 H2:H120），並透過 batch_update 一次送出；
+        超過單次請求上限時自動拆成多個請求
+        
+        Returns:
+            int: 已更新的列數
+        """
+        if confirmed_col_idx is None:
+            logger.warning("找不到「已發放」欄位，無法更新")
+            return 0
+        if not row_numbers:
+            return 0
+        
+        try:
+            col_letter = self._number_to_column_letter(confirmed_col_idx + 1)
+            updated = 0
+            for batch in self._split_batches(self._coalesce_ranges(row_numbers)):
+                data = [
+                    {
+                        'range': f"{col_letter}{start}:{col_letter}{end}",
+                        'values': [['V']] * (end - start + 1)
+                    }
+                    for start, end in batch
+                ]
+                self._worksheet_call('batch_update', data)
+                batch_rows = sum(end - start + 1 for start, end in batch)
+                updated += batch_rows
+                logger.info(f"已批次更新 {batch_rows} 行的「已發放」欄位為 V（{len(data)} 個範圍）")
+            
+            # 推進高水位（同步結束時由 save_high_water_mark 寫入），下次同步不必再讀取這些已確認的資料列
+            self.release_rows(row_numbers)
+            return updated
+        except Exception as e:
+            logger.error(f"批次更新「已發放」欄位失敗: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _coalesce_ranges(numbers):
+        """將行號（或欄位索引）合併為連續範圍 [(start, end), ...]"""
+        ranges = []
+        for number in sorted(set(numbers)):
+            if ranges and number == ranges[-1][1] + 1:
+                ranges[-1][1] = number
+            else:
+                ranges.append([number, number])
+        return [(start, end) for start, end in ranges]
+    
+    @staticmethod
+    def _split_batches(ranges):
+        """依照單次請求的儲存格數與範圍數上限，將範圍切分成多個批次"""
+        batches = []
+        current = []
+        current_cells = 0
+        for start, end in ranges:
+            # 單一範圍超過儲存格上限時先切段
+            while end - start + 1 > MAX_CELLS_PER_BATCH:
+                if current:
+                    batches.append(current)
+                    current, current_cells = [], 0
+                batches.append([(start, start + MAX_CELLS_PER_BATCH - 1)])
+                start += MAX_CELLS_PER_BATCH
+            cells = end - start + 1
+            if current and (current_cells + cells > MAX_CELLS_PER_BATCH or len(current) >= MAX_RANGES_PER_BATCH):
+                batches.append(current)
+                current, current_cells = [], 0
+            current.append((start, end))
+            current_cells += cells
+        if current:
+            batches.append(current)
+        return batches
+    
     def _number_to_column_letter(self, n):
         """將數字轉換為 Excel 欄位字母（1->A, 2->B, ..., 27->AA）"""
         result = ""
@@ -0,0 +1,139 @@
+"""
+試算表內容的本地快照（SQLite 檔案，使用標準函式庫 sqlite3）
+
+記錄每個工作表最後一次讀取時的 Drive 修訂（version + modifiedTime）與各資料列的內容雜湊：
+- 修訂沒有變更時，同步只需要一次 Drive metadata 請求即可確認「沒有變更」，不必下載工作表
+- 修訂有變更時，以雜湊比對找出新增或被編輯的資料列；
+  內容沒有變更、且上次已被驗證拒絕的資料列不會再送進解析與寫入流程
+"""
+from contextlib import closing
+from pathlib import Path
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class SheetSnapshot:
+    """工作表快照（每次操作開啟新的連線，可在讀取、解析等不同執行緒中使用）"""
+    
+    def __init__(self, path):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.initialized = False
+    
+    def get_revision(self, key):
+        """取得上次同步完成時記錄的修訂，沒有記錄時回傳 None"""
+        row = self._query_one("SELECT revision FROM sheet_meta WHERE sheet_key = ?", (key,))
+        return row[0] if row else None
+    
+    def set_revision(self, key, revision):
+        """記錄修訂（None 表示下次同步必須重新讀取）"""
+        self._execute(
+            "INSERT INTO sheet_meta (sheet_key, revision, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(sheet_key) DO UPDATE SET revision = excluded.revision, updated_at = excluded.updated_at",
+            [(key, revision, time.time())]
+        )
+    
+    def get_header_checksum(self, key):
+        row = self._query_one("SELECT header_checksum FROM sheet_meta WHERE sheet_key = ?", (key,))
+        return row[0] if row else None
+    
+    def reset(self, key, header_checksum):
+        """標題列變更時清除此工作表的資料列快照"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sheet_rows WHERE sheet_key = ?", (key,))
+            conn.execute(
+                "INSERT INTO sheet_meta (sheet_key, revision, header_checksum, updated_at) VALUES (?, NULL, ?, ?) "
+                "ON CONFLICT(sheet_key) DO UPDATE SET revision = NULL, header_checksum = excluded.header_checksum, "
+                "updated_at = excluded.updated_at",
+                (key, header_checksum, time.time())
+            )
+    
+    def diff(self, key, row_hashes):
+        """
+        與快照比對並更新快照
+        
+        Args:
+            row_hashes: {行號: 內容雜湊}
+        
+        Returns:
+            set: 內容沒有變更、且上次已被拒絕的行號（不需要再處理）
+        """
+        if not row_hashes:
+            return set()
+        first, last = min(row_hashes), max(row_hashes)
+        with self._connect() as conn:
+            previous = {
+                row_number: (row_hash, rejected)
+                for row_number, row_hash, rejected in conn.execute(
+                    "SELECT row_number, row_hash, rejected FROM sheet_rows "
+                    "WHERE sheet_key = ? AND row_number BETWEEN ? AND ?",
+                    (key, first, last)
+                )
+            }
+            settled = set()
+            changed = []
+            for row_number, row_hash in row_hashes.items():
+                old = previous.get(row_number)
+                if old is not None and old[0] == row_hash:
+                    if old[1]:
+                        settled.add(row_number)
+                    continue
+                changed.append((key, row_number, row_hash))
+            conn.executemany(
+                "INSERT INTO sheet_rows (sheet_key, row_number, row_hash, rejected) VALUES (?, ?, ?, 0) "
+                "ON CONFLICT(sheet_key, row_number) DO UPDATE SET row_hash = excluded.row_hash, rejected = 0",
+                changed
+            )
+        return settled
+    
+    def mark_rejected(self, key, row_numbers):
+        """記錄驗證失敗的資料列（內容沒有變更前，之後的同步會略過這些資料列）"""
+        self._execute(
+            "UPDATE sheet_rows SET rejected = 1 WHERE sheet_key = ? AND row_number = ?",
+            [(key, row_number) for row_number in row_numbers]
+        )
+    
+    def _connect(self):
+        """開啟連線（第一次使用時建立資料表）；with 區塊結束時提交並關閉"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            with self.lock:
+                if not self.initialized:
+                    conn.executescript(
+                        "CREATE TABLE IF NOT EXISTS sheet_meta ("
+                        "sheet_key TEXT PRIMARY KEY, revision TEXT, header_checksum TEXT, updated_at REAL);"
+                        "CREATE TABLE IF NOT EXISTS sheet_rows ("
+                        "sheet_key TEXT NOT NULL, row_number INTEGER NOT NULL, row_hash TEXT NOT NULL, "
+                        "rejected INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (sheet_key, row_number)) WITHOUT ROWID;"
+                    )
+                    self.initialized = True
+        return _Transaction(conn)
+    
+    def _execute(self, sql, params_list):
+        with self._connect() as conn:
+            conn.executemany(sql, params_list)
+    
+    def _query_one(self, sql, params):
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchone()
+
+class _Transaction:
+    """sqlite3 連線的 with 包裝：成功時提交、例外時回滾，最後關閉連線"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def __enter__(self):
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb):
+        with closing(self.conn):
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        return False
@@ -0,0 +1,97 @@
+from flask import current_app
+from models import db, ActiveReward
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class RewardCountCache:
+    """
+    active_reward 筆數快取（供 /api/status 使用）
+    超過 TTL 時先回傳舊值，並在背景重新計算（stale-while-revalidate），
+    同步寫入資料庫後會直接累加筆數，因此狀態查詢不必每次都執行 COUNT(*)
+    （累加值為近似值，TTL 到期後仍會以 COUNT 重新校正）
+    """
+    
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.refreshing = set()
+    
+    def get(self, name):
+        """
+        取得統計值（name：total 總筆數、state 依狀態、round 依執行代號）；第一次查詢時同步計算，之後只讀取記憶體
+        
+        Returns:
+            dict: {'value', 'loaded_at', 'age', 'stale'}
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            entry = self._load(name)
+        elif time.time() - entry['loaded_at'] > self.ttl:
+            self._refresh_async(name)
+        
+        age = time.time() - entry['loaded_at']
+        return {
+            'value': entry['value'],
+            'loaded_at': entry['loaded_at'],
+            'age': round(age, 3),
+            'stale': age > self.ttl
+        }
+    
+    def add(self, count, state=1):
+        """同步寫入資料庫後累加筆數（依執行代號的統計改為下次查詢時重新計算）"""
+        if count <= 0:
+            return
+        with self.lock:
+            if 'total' in self.entries:
+                self.entries['total']['value'] += count
+            if 'state' in self.entries:
+                by_state = self.entries['state']['value']
+                by_state[str(state)] = by_state.get(str(state), 0) + count
+            if 'round' in self.entries:
+                self.entries['round']['loaded_at'] = 0
+    
+    def invalidate(self):
+        """清除所有快取值"""
+        with self.lock:
+            self.entries.clear()
+    
+    def _load(self, name):
+        """在目前的 app context 中計算統計值並存入快取"""
+        if name == 'total':
+            value = db.session.query(db.func.count(ActiveReward.id)).scalar()
+        else:
+            column = getattr(ActiveReward, name)
+            rows = db.session.query(column, db.func.count(ActiveReward.id)).group_by(column).all()
+            value = {str(key): count for key, count in rows}
+        entry = {'value': value, 'loaded_at': time.time()}
+        with self.lock:
+            self.entries[name] = entry
+        return entry
+    
+    def _refresh_async(self, name):
+        """在背景執行緒重新計算（同一統計項目同時只會有一個重新計算）"""
+        with self.lock:
+            if name in self.refreshing:
+                return
+            self.refreshing.add(name)
+        app = current_app._get_current_object()
+        
+        def refresh():
+            try:
+                with app.app_context():
+                    self._load(name)
+            except Exception as e:
+                logger.warning(f"重新計算 active_reward 統計（{name}）失敗: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(name)
+        
+        threading.Thread(target=refresh, name=f'reward-count-{name}', daemon=True).start()
+
+# 程序層級的筆數快取（TTL 由 app.py 依設定檔 STATUS_CACHE_TTL 設定）
+reward_counts = RewardCountCache()
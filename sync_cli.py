@@ -0,0 +1,86 @@
+"""
+命令列同步（不啟動網頁伺服器，適合排程工具或打包後的 exe 直接執行）
+
+只載入 config、models、sheets_service 與 sync_service，不載入 CORS、網頁範本與 OAuth 路由；
+gspread 與 google-auth 在第一次呼叫 API 時才匯入，MySQL 驅動在第一次連線時才匯入。
+啟動時會建立不存在的資料表並套用尚未執行的資料庫遷移（試執行不連線資料庫，因此略過）。
+
+使用方式：
+    python -m sync_cli                    # 同步設定檔中的所有工作表
+    python -m sync_cli --dry-run          # 試執行：只讀取與驗證，不寫入資料庫也不回寫試算表
+    python -m sync_cli --batch-size 500 --json
+
+結束代碼：0 成功、1 同步失敗、2 參數錯誤
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='sync_cli', description='同步 Google Sheets 資料到資料庫（命令列）')
+    parser.add_argument('--dry-run', action='store_true', help='試執行：只讀取與驗證資料，不寫入資料庫、不回寫「已發放」欄位')
+    parser.add_argument('--batch-size', type=int, default=None, help='每批寫入資料庫的筆數（預設使用 SYNC_BATCH_SIZE）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出同步結果')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='日誌等級（輸出到 stderr）')
+    args = parser.parse_args(argv)
+    if args.batch_size is not None and args.batch_size <= 0:
+        parser.error('--batch-size 必須大於 0')
+    return args
+
+def create_app(with_db=True):
+    """
+    建立只提供 app context 的 Flask app（不註冊任何路由）
+    with_db=False 時不初始化資料庫（試執行不需要連線，也不會載入 MySQL 驅動）
+    with_db=True 時建立資料表並套用尚未執行的遷移（與 app.py 相同，同步寫入需要來源識別鍵欄位與索引）
+    """
+    from flask import Flask
+    from config import get_config
+    from models import db
+    
+    app = Flask(__name__)
+    if with_db:
+        from migrations import ensure_schema
+        config = get_config()
+        app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config.SQLALCHEMY_ENGINE_OPTIONS
+        db.init_app(app)
+        with app.app_context():
+            ensure_schema(db.engine)
+    return app
+
+def run(args):
+    """執行同步並回傳結果字典"""
+    from sync_service import sync_sources
+    
+    app = create_app(with_db=not args.dry_run)
+    with app.app_context():
+        return sync_sources(batch_size=args.batch_size, dry_run=args.dry_run)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=getattr(logging, args.log_level),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+    # 單次執行的程序不需要監看設定檔
+    os.environ.setdefault('CONFIG_RELOAD_INTERVAL', '0')
+    
+    try:
+        result = run(args)
+    except Exception as e:
+        logging.exception("同步失敗")
+        result = {'success': False, 'message': f'同步失敗: {str(e)}', 'count': 0}
+    
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    else:
+        print(result.get('message', ''))
+        for source_result in result.get('sources', []):
+            print(f"  {source_result['source'].get('spreadsheet_id')} {source_result['source'].get('worksheet_name') or source_result['source'].get('worksheet_gid')}: {source_result.get('message')}")
+    return 0 if result.get('success') else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
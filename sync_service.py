@@ -1,75 +1,381 @@
+from flask import current_app
 from models import db, ActiveReward
 from sheets_service import GoogleSheetsService
+from config import get_config
+from row_parser import RowParser
+from status_service import reward_counts
+from metrics import sync_runs, sync_rows, sync_stage_seconds, sync_duration_seconds, sync_rows_per_second
+from sqlalchemy.dialects import mysql, sqlite
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
+import queue
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+class _SingleFlight:
+    """同一個 key 同時只執行一次；後到的呼叫會等待並共用執行中那一次的結果"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+    
+    def do(self, key, fn):
+        """
+        Returns:
+            tuple: (結果, 是否為加入既有執行)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None}
+                self.calls[key] = call
+        
+        if not leader:
+            call['event'].wait()
+            return call['result'], True
+        
+        try:
+            call['result'] = fn()
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['event'].set()
+        return call['result'], False
+
+# 程序內的同步協調器：每個試算表/工作表同時只有一個同步流程
+_sync_flight = _SingleFlight()
+
+# 管線階段結束的標記
+_DONE = object()
+
+class _StageTimer:
+    """管線階段的忙碌/閒置時間統計"""
+    
+    def __init__(self):
+        self.busy = 0.0
+        self.idle = 0.0
+        self.items = 0
+    
+    def as_dict(self):
+        return {
+            'busy_seconds': round(self.busy, 4),
+            'idle_seconds': round(self.idle, 4),
+            'items': self.items
+        }
+
+def sync_sources(batch_size=None, progress=None, dry_run=False):
+    """
+    同步設定檔 SHEET_SOURCES 中的所有工作表
+    只有一個工作表時直接執行 SyncService.sync_data（回應格式不變）；
+    多個工作表時以有界執行緒池（SYNC_SOURCE_WORKERS）同時同步，共用同一個已授權的 gspread client 與資料庫引擎，
+    並彙總各工作表的結果（需要在 Flask app context 中呼叫）
+    
+    Args:
+        batch_size: 每批寫入的筆數（未指定時使用設定檔的 SYNC_BATCH_SIZE）
+        progress: 選用的進度字典，所有工作表的進度累加到同一個字典
+        dry_run: 試執行，只讀取與驗證資料，不寫入資料庫也不回寫試算表（見 SyncService）
+    """
+    config = get_config()
+    sources = config.SHEET_SOURCES
+    if len(sources) == 1:
+        return SyncService(batch_size=batch_size, source=sources[0], dry_run=dry_run).sync_data(progress=progress)
+    
+    if progress is None:
+        progress = {'rows_read': 0, 'inserted': 0, 'duplicates': 0, 'confirmed': 0, 'failed': 0}
+    progress_lock = threading.Lock()
+    app = current_app._get_current_object()
+    
+    def sync_one(source):
+        # 每個執行緒需要自己的 app context（db.session 以執行緒區分）
+        try:
+            with app.app_context():
+                sync_service = SyncService(batch_size=batch_size, source=source, dry_run=dry_run)
+                return sync_service.sync_data(progress=progress, progress_lock=progress_lock)
+        except Exception as e:
+            logger.exception(f"同步工作表 {source} 失敗")
+            return {'success': False, 'message': f'同步失敗: {str(e)}', 'count': 0}
+    
+    workers = max(1, min(config.SYNC_SOURCE_WORKERS, len(sources)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync-source') as executor:
+        results = list(executor.map(sync_one, sources))
+    
+    count = sum(result.get('count', 0) for result in results)
+    error_count = sum(result.get('error_count', 0) for result in results)
+    failed_sources = sum(1 for result in results if not result.get('success'))
+    if dry_run:
+        message = f'{len(sources)} 個工作表試執行完成，{count} 筆資料可寫入'
+    else:
+        message = f'{len(sources)} 個工作表同步完成，成功處理 {count} 筆資料'
+    if error_count > 0:
+        message += f'，{error_count} 筆失敗'
+    if failed_sources > 0:
+        message += f'，{failed_sources} 個工作表同步失敗'
+    
+    return {
+        'success': failed_sources == 0,
+        'message': message,
+        'count': count,
+        'error_count': error_count,
+        'failed_sources': failed_sources,
+        'sources': [dict(result, source=source) for source, result in zip(sources, results)]
+    }
+
 class SyncService:
     """資料同步服務"""
     
-    def __init__(self):
-        self.sheets_service = GoogleSheetsService()
+    def __init__(self, batch_size=None, source=None, dry_run=False):
+        # source：要同步的工作表，未指定時使用設定檔最上層的工作表設定
+        # dry_run：試執行，只讀取與解析驗證，不寫入資料庫、不回寫「已發放」、不更新快照與增量讀取狀態
+        self.dry_run = dry_run
+        self.sheets_service = GoogleSheetsService(source=source, read_only=dry_run)
+        # 每批寫入的筆數（未指定時使用設定檔的 SYNC_BATCH_SIZE）
+        self.batch_size = max(1, int(batch_size or self.sheets_service.config.SYNC_BATCH_SIZE))
     
-    def sync_data(self):
+    def sync_data(self, progress=None, progress_lock=None):
         """
         同步 Google Sheets 資料到資料庫
         1. 讀取未確認的資料
-        2. 寫入資料庫
+        2. 分批寫入資料庫（每批一個交易、一次多筆 INSERT）
         3. 更新 Google Sheets 確認欄位
+        三個步驟以分頁串流方式重疊進行（見 _sync_data）
+        
+        同一個工作表同時只會執行一個同步流程：程序內的並行呼叫會加入執行中的流程並取得相同結果；
+        啟用 SYNC_DB_LOCK 時另以 MySQL GET_LOCK 避免多個 worker 程序同時同步
+        
+        Args:
+            progress: 選用的進度字典（rows_read、inserted、confirmed、failed），執行中會即時更新
+            progress_lock: 多個同步共用同一個進度字典時使用的鎖
         """
-        try:
-            # 取得未確認的資料列
-            unconfirmed_rows, headers, confirmed_col_idx = self.sheets_service.get_unconfirmed_rows()
-            
-            if not unconfirmed_rows:
+        if self.dry_run:
+            # 試執行不寫入任何資料，不需要與其他同步互斥
+            return self._sync_data(progress, progress_lock)
+        key = self.sheets_service._cache_key()
+        result, joined = _sync_flight.do(key, lambda: self._sync_with_db_lock(key, progress, progress_lock))
+        if joined:
+            logger.info("已有相同工作表的同步正在執行，共用其結果")
+            if result is None:
+                # 執行中的流程拋出例外而沒有結果
+                result = {'success': False, 'message': '同步失敗', 'count': 0}
+            result = dict(result, joined=True)
+        return result
+    
+    def _sync_with_db_lock(self, key, progress, progress_lock=None):
+        """視設定取得 MySQL 具名鎖後執行同步（跨程序互斥）"""
+        config = self.sheets_service.config
+        if not config.SYNC_DB_LOCK or db.engine.dialect.name != 'mysql':
+            return self._sync_data(progress, progress_lock)
+        
+        # GET_LOCK 的名稱上限為 64 字元
+        lock_name = 'active_reward_sync:' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:32]
+        with db.engine.connect() as conn:
+            acquired = conn.execute(
+                db.text("SELECT GET_LOCK(:name, :timeout)"),
+                {'name': lock_name, 'timeout': config.SYNC_DB_LOCK_TIMEOUT}
+            ).scalar()
+            if acquired != 1:
+                logger.warning(f"其他程序正在同步此工作表（{lock_name}）")
                 return {
-                    'success': True,
-                    'message': '沒有需要處理的資料',
-                    'count': 0
+                    'success': False,
+                    'message': '其他程序正在同步此工作表，請稍後再試',
+                    'count': 0,
+                    'busy': True
                 }
+            try:
+                return self._sync_data(progress, progress_lock)
+            finally:
+                conn.execute(db.text("SELECT RELEASE_LOCK(:name)"), {'name': lock_name})
+    
+    def _sync_data(self, progress=None, progress_lock=None):
+        """
+        實際的同步流程（由 sync_data 在取得鎖後呼叫）
+        以有界佇列串接四個階段，讓 Google 的網路延遲與 MySQL 寫入重疊進行：
+        讀取分頁（執行緒）→ 解析（執行緒）→ 寫入資料庫（呼叫端執行緒，需要 app context）→ 回寫確認（執行緒）
+        佇列長度固定（SYNC_QUEUE_SIZE），因此不論工作表多大，記憶體中最多只有少數幾頁資料
+        """
+        if progress is None:
+            progress = {'rows_read': 0, 'inserted': 0, 'duplicates': 0, 'confirmed': 0, 'failed': 0}
+        config = self.sheets_service.config
+        run_started = time.perf_counter()
+        try:
+            stop = threading.Event()
+            errors = []
+            stats_lock = progress_lock or threading.Lock()
+            timers = {name: _StageTimer() for name in ('read', 'parse', 'write', 'confirm')}
+            parse_queue = queue.Queue(maxsize=config.SYNC_QUEUE_SIZE)
+            write_queue = queue.Queue(maxsize=config.SYNC_QUEUE_SIZE)
+            confirm_queue = queue.Queue(maxsize=config.SYNC_QUEUE_SIZE)
+            totals = {'success': 0, 'error': 0, 'read': 0, 'inserted': 0}
+            rejected = []
+            chunk_stats = []
             
-            success_count = 0
-            error_count = 0
-            
-            # 處理每一筆資料
-            for row_info in unconfirmed_rows:
+            def run_stage(name, fn, output_queue):
+                """在執行緒中執行階段；發生例外時通知其他階段停止，結束時傳遞 _DONE"""
                 try:
-                    row_data = row_info['data']
-                    row_number = row_info['row_number']
-                    
-                    # 根據 headers 建立資料字典
-                    data_dict = {}
-                    for idx, header in enumerate(headers):
-                        if idx < len(row_data):
-                            data_dict[header] = row_data[idx]
-                    
-                    # 映射試算表欄位到資料庫欄位
-                    # 試算表欄位：日期、執行代號、角色身分證、角色ID、道具編號、補償道具名稱、數量、已發放
-                    reward = ActiveReward(
-                        round=self._parse_int(data_dict.get('執行代號')),
-                        char_id=data_dict.get('角色身分證'),
-                        char_name=data_dict.get('角色ID'),
-                        item_id=data_dict.get('道具編號'),
-                        item_name=data_dict.get('補償道具名稱'),
-                        item_count=self._parse_int(data_dict.get('數量')),
-                        state=1  # 1 表示已發放（系統已發放給玩家）
-                    )
-                    
-                    db.session.add(reward)
-                    db.session.commit()
-                    
-                    # 更新 Google Sheets「已發放」欄位為 V
-                    self.sheets_service.update_confirmation(row_number, confirmed_col_idx)
-                    
-                    success_count += 1
-                    
+                    fn()
                 except Exception as e:
-                    db.session.rollback()
-                    logger.error(f"處理第 {row_number} 行資料時發生錯誤: {str(e)}")
-                    error_count += 1
-                    continue
+                    logger.exception(f"同步管線「{name}」階段失敗")
+                    errors.append(e)
+                    stop.set()
+                finally:
+                    if output_queue is not None:
+                        self._put(output_queue, _DONE, stop, timers[name])
+            
+            def read_stage():
+                timer = timers['read']
+                pages = self.sheets_service.iter_unconfirmed_pages(page_size=config.SYNC_PAGE_SIZE)
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    page = next(pages, _DONE)
+                    elapsed = time.perf_counter() - started
+                    timer.busy += elapsed
+                    if page is _DONE:
+                        break
+                    sync_stage_seconds.observe(elapsed, stage='read')
+                    timer.items += 1
+                    with stats_lock:
+                        totals['read'] += len(page[0])
+                        progress['rows_read'] += len(page[0])
+                    if page[0]:
+                        self._put(parse_queue, page, stop, timer)
+            
+            def parse_stage():
+                timer = timers['parse']
+                parser = None
+                while True:
+                    page = self._get(parse_queue, stop, timer)
+                    if page is _DONE:
+                        break
+                    started = time.perf_counter()
+                    page_rows, headers, confirmed_col_idx = page
+                    if parser is None:
+                        # 標題只解析一次，建立欄位轉換表
+                        parser = RowParser(headers, self.sheets_service.spreadsheet_id, self.sheets_service.worksheet.id)
+                    records, row_numbers, page_rejected, blank_rows = parser.parse(page_rows)
+                    if page_rejected and not self.dry_run:
+                        self.sheets_service.mark_rejected([item['row_number'] for item in page_rejected])
+                    if blank_rows:
+                        # 空白列不寫入也不確認，也不阻擋增量讀取的高水位
+                        self.sheets_service.release_rows(blank_rows)
+                    elapsed = time.perf_counter() - started
+                    sync_stage_seconds.observe(elapsed, stage='parse')
+                    timer.busy += elapsed
+                    timer.items += 1
+                    with stats_lock:
+                        rejected.extend(page_rejected)
+                        totals['error'] += len(page_rejected)
+                        progress['failed'] += len(page_rejected)
+                    if records:
+                        self._put(write_queue, (records, row_numbers, confirmed_col_idx), stop, timer)
+            
+            def confirm_stage():
+                timer = timers['confirm']
+                while True:
+                    item = self._get(confirm_queue, stop, timer)
+                    if item is _DONE:
+                        break
+                    inserted_rows, confirmed_col_idx, chunk_stat = item
+                    started = time.perf_counter()
+                    # 整批交易提交後，一次批次更新 Google Sheets「已發放」欄位為 V（只更新已成功寫入的資料列）
+                    try:
+                        confirmed = self.sheets_service.update_confirmations(inserted_rows, confirmed_col_idx)
+                        with stats_lock:
+                            totals['success'] += confirmed
+                            progress['confirmed'] += confirmed
+                    except Exception as e:
+                        logger.error(f"更新第 {chunk_stat['start_row']}~{chunk_stat['end_row']} 行「已發放」欄位時發生錯誤: {str(e)}")
+                        with stats_lock:
+                            totals['error'] += len(inserted_rows)
+                    elapsed = time.perf_counter() - started
+                    sync_stage_seconds.observe(elapsed, stage='confirm')
+                    chunk_stat['confirm_seconds'] = round(elapsed, 4)
+                    timer.busy += elapsed
+                    timer.items += 1
+            
+            threads = [
+                threading.Thread(target=run_stage, args=('read', read_stage, parse_queue), name='sync-read', daemon=True),
+                threading.Thread(target=run_stage, args=('parse', parse_stage, write_queue), name='sync-parse', daemon=True),
+                threading.Thread(target=run_stage, args=('confirm', confirm_stage, None), name='sync-confirm', daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+            
+            # 寫入資料庫階段在呼叫端執行緒進行（db.session 需要 Flask app context）
+            timer = timers['write']
+            try:
+                while True:
+                    item = self._get(write_queue, stop, timer)
+                    if item is _DONE:
+                        break
+                    page_records, page_row_numbers, confirmed_col_idx = item
+                    # 依批次處理資料
+                    for start in range(0, len(page_records), self.batch_size):
+                        records = page_records[start:start + self.batch_size]
+                        row_numbers = page_row_numbers[start:start + self.batch_size]
+                        chunk_started = time.perf_counter()
+                        if self.dry_run:
+                            inserted_rows, failed, inserted = list(row_numbers), 0, len(row_numbers)
+                        else:
+                            inserted_rows, failed, inserted = self._write_chunk(records, row_numbers)
+                        db_elapsed = time.perf_counter() - chunk_started
+                        sync_stage_seconds.observe(db_elapsed, stage='write')
+                        timer.busy += db_elapsed
+                        timer.items += 1
+                        with stats_lock:
+                            totals['inserted'] += inserted
+                            totals['error'] += failed
+                            progress['inserted'] += inserted
+                            progress['duplicates'] += len(inserted_rows) - inserted
+                            progress['failed'] += failed
+                        chunk_stat = {
+                            'start_row': row_numbers[0],
+                            'end_row': row_numbers[-1],
+                            'rows': len(records),
+                            'inserted': inserted,
+                            'duplicates': len(inserted_rows) - inserted,
+                            'failed': failed,
+                            'fallback': failed > 0,
+                            'db_seconds': round(db_elapsed, 4)
+                        }
+                        chunk_stats.append(chunk_stat)
+                        if inserted_rows and not self.dry_run:
+                            self._put(confirm_queue, (inserted_rows, confirmed_col_idx, chunk_stat), stop, timer)
+            except Exception as e:
+                logger.exception("同步管線「write」階段失敗")
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(confirm_queue, _DONE, stop, timer)
+                for thread in threads:
+                    thread.join()
+                # 所有階段結束後一次儲存增量讀取的高水位
+                self.sheets_service.save_high_water_mark()
+            
+            if errors:
+                raise errors[0]
+            
+            if not self.dry_run:
+                self._record_run('success', totals, time.perf_counter() - run_started)
+            if totals['read'] == 0:
+                return {
+                    'success': True,
+                    'message': '試算表沒有變更' if self.sheets_service.unchanged else '沒有需要處理的資料',
+                    'count': 0,
+                    'unchanged': self.sheets_service.unchanged,
+                    'skipped': self.sheets_service.skipped
+                }
             
-            message = f'發放完成！成功處理 {success_count} 筆資料'
+            success_count = totals['success']
+            error_count = totals['error']
+            if self.dry_run:
+                # 試執行沒有回寫確認，以通過驗證、可寫入的筆數作為 count
+                success_count = totals['inserted']
+                message = f'試執行完成！{success_count} 筆資料可寫入'
+            else:
+                message = f'發放完成！成功處理 {success_count} 筆資料'
             if error_count > 0:
                 message += f'，{error_count} 筆失敗'
             
@@ -77,25 +383,149 @@ class SyncService:
                 'success': True,
                 'message': message,
                 'count': success_count,
-                'error_count': error_count
+                'error_count': error_count,
+                'dry_run': self.dry_run,
+                'batch_size': self.batch_size,
+                'page_size': config.SYNC_PAGE_SIZE,
+                'parse_seconds': round(timers['parse'].busy, 4),
+                'rejected': rejected,
+                'skipped': self.sheets_service.skipped,
+                'chunks': chunk_stats,
+                'stages': {name: stage_timer.as_dict() for name, stage_timer in timers.items()}
             }
             
         except Exception as e:
             logger.error(f"同步資料失敗: {str(e)}")
+            sync_runs.inc(result='error')
             return {
                 'success': False,
                 'message': f'同步失敗: {str(e)}',
                 'count': 0
             }
     
-    def _parse_int(self, value_str):
-        """解析整數字串為整數"""
-        if not value_str:
-            return None
+    @staticmethod
+    def _record_run(result, totals, elapsed):
+        """更新監控指標（每次同步一次，不逐列記錄）"""
+        sync_runs.inc(result=result)
+        sync_rows.inc(totals['read'], outcome='read')
+        sync_rows.inc(totals['inserted'], outcome='inserted')
+        sync_rows.inc(totals['success'], outcome='confirmed')
+        sync_rows.inc(totals['error'], outcome='failed')
+        sync_duration_seconds.observe(elapsed)
+        sync_rows_per_second.set(round(totals['inserted'] / elapsed, 1) if elapsed > 0 else 0.0)
+    
+    @staticmethod
+    def _put(q, item, stop, timer):
+        """放入有界佇列（佇列已滿時等待，形成背壓）；管線停止時放棄，等待時間計入閒置"""
+        started = time.perf_counter()
+        while True:
+            try:
+                q.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                if stop.is_set():
+                    break
+        timer.idle += time.perf_counter() - started
+    
+    @staticmethod
+    def _get(q, stop, timer):
+        """從佇列取出項目；管線停止且佇列為空時回傳 _DONE，等待時間計入閒置"""
+        started = time.perf_counter()
+        while True:
+            try:
+                item = q.get(timeout=0.2)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    item = _DONE
+                    break
+        timer.idle += time.perf_counter() - started
+        return item
+    
+    def _write_chunk(self, records, row_numbers):
+        """
+        以單一交易、多筆 INSERT（executemany）寫入一批資料
+        整批失敗時才退回逐筆寫入，避免單筆錯誤資料拖累整批
+        來源識別鍵重複的資料列會被略過（視為已寫入），因此整批重播是安全的
+        
+        Returns:
+            tuple: (成功寫入的行號列表（包含先前已寫入而略過的資料列）, 失敗筆數, 實際新增的筆數)
+        """
+        if not records:
+            return [], 0, 0
+        
+        insert_stmt = self._idempotent_insert()
         try:
-            # 移除可能的逗號和空白
-            cleaned = str(value_str).replace(',', '').strip()
-            return int(cleaned)
-        except (ValueError, TypeError):
-            return None
-
+            inserted = self._execute_insert(insert_stmt, records)
+            return list(row_numbers), 0, inserted
+        except Exception as e:
+            logger.warning(f"批次寫入第 {row_numbers[0]}~{row_numbers[-1]} 行失敗，改為逐筆寫入: {str(e)}")
+        
+        inserted_rows = []
+        failed = 0
+        inserted = 0
+        for record, row_number in zip(records, row_numbers):
+            try:
+                inserted += self._execute_insert(insert_stmt, [record])
+                inserted_rows.append(row_number)
+            except Exception as e:
+                logger.error(f"處理第 {row_number} 行資料時發生錯誤: {str(e)}")
+                failed += 1
+        
+        return inserted_rows, failed, inserted
+    
+    def _execute_insert(self, insert_stmt, records):
+        """
+        執行多筆 INSERT 並提交
+        DB_BULK_AUTOCOMMIT 啟用時使用 autocommit 連線（不開交易，減少往返），否則以 session 交易寫入
+        
+        Returns:
+            int: 實際新增的筆數（來源識別鍵重複而略過的資料列不計入）
+        """
+        if self.sheets_service.config.DB_BULK_AUTOCOMMIT:
+            with db.engine.connect() as conn:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                existing = self._existing_sources(conn, records)
+                conn.execute(insert_stmt, records)
+        else:
+            try:
+                existing = self._existing_sources(db.session, records)
+                db.session.execute(insert_stmt, records)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        # rowcount 不可靠（ON DUPLICATE KEY UPDATE 在 CLIENT.FOUND_ROWS 下重複的資料列也會計入），
+        # 改以寫入前已存在的來源識別鍵計算實際新增的筆數
+        inserted = sum(1 for record in records if (record['source_row'], record['source_hash']) not in existing)
+        # 累加 /api/status 的筆數快取
+        reward_counts.add(inserted)
+        return inserted
+    
+    @staticmethod
+    def _existing_sources(executor, records):
+        """
+        查詢這批資料列中已寫入的來源識別鍵 {(source_row, source_hash), ...}
+        同一批資料來自同一個工作表，以來源唯一索引的前綴（試算表、GID、行號）查詢
+        """
+        table = ActiveReward.__table__
+        rows = executor.execute(
+            db.select(table.c.source_row, table.c.source_hash).where(
+                table.c.source_spreadsheet_id == records[0]['source_spreadsheet_id'],
+                table.c.source_gid == records[0]['source_gid'],
+                table.c.source_row.in_(set(record['source_row'] for record in records))
+            )
+        )
+        return set((row[0], row[1]) for row in rows)
+    
+    @staticmethod
+    def _idempotent_insert():
+        """建立遇到重複來源識別鍵時略過的 INSERT（MySQL：ON DUPLICATE KEY UPDATE）"""
+        table = ActiveReward.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'mysql':
+            # 只略過重複鍵，其他錯誤（例如資料過長）仍會拋出，不使用 INSERT IGNORE
+            return mysql.insert(table).on_duplicate_key_update(id=table.c.id)
+        if dialect == 'sqlite':
+            return sqlite.insert(table).on_conflict_do_nothing()
+        return table.insert()
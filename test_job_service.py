@@ -0,0 +1,57 @@
+"""
+測試：同一工作表同時送出多個同步請求時，只建立一個背景工作
+"""
+import threading
+import time
+
+from flask import Flask
+
+import job_service
+from job_service import SyncJobManager
+
+def test_concurrent_submit_creates_one_job(monkeypatch):
+    """多個執行緒同時呼叫 submit，只會有一個 job_id，其餘請求加入同一個工作"""
+    release = threading.Event()
+    calls = []
+    
+    def fake_sync_sources(progress=None, **kwargs):
+        calls.append(kwargs)
+        release.wait(5)
+        return {'success': True, 'message': 'ok', 'count': 0}
+    
+    # 拉長建立工作與登記之間的時間，檢查與登記不在同一次持有鎖時必定重複建立工作
+    uuid4 = job_service.uuid.uuid4
+    
+    def slow_uuid4():
+        time.sleep(0.05)
+        return uuid4()
+    
+    monkeypatch.setattr(job_service, 'sync_sources', fake_sync_sources)
+    monkeypatch.setattr(job_service.uuid, 'uuid4', slow_uuid4)
+    
+    manager = SyncJobManager(Flask(__name__))
+    threads_count = 8
+    barrier = threading.Barrier(threads_count)
+    results = []
+    results_lock = threading.Lock()
+    
+    def submit():
+        barrier.wait()
+        job = manager.submit()
+        with results_lock:
+            results.append(job)
+    
+    threads = [threading.Thread(target=submit) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    try:
+        assert len(results) == threads_count
+        assert len(set(job['job_id'] for job in results)) == 1
+        assert sum(1 for job in results if job.get('joined')) == threads_count - 1
+    finally:
+        release.set()
+        manager.wait(results[0]['job_id'], timeout=5)
+    assert len(calls) == 1
@@ -0,0 +1,45 @@
+"""
+測試：RowParser 的必填欄位檢查與空白列處理
+"""
+from row_parser import RowParser
+
+HEADERS = ['日期', '執行代號', '角色身分證', '角色ID', '道具編號', '補償道具名稱', '數量', '已發放']
+
+def make_rows(*rows, start=2):
+    return [
+        {'row_number': row_number, 'data': list(data), 'confirmed_col_idx': len(HEADERS) - 1}
+        for row_number, data in enumerate(rows, start=start)
+    ]
+
+def test_blank_row_is_skipped_without_confirming():
+    """工作表中間的空白列不寫入、不確認，也不算驗證失敗"""
+    rows = make_rows(
+        ['2025-01-01', '1', 'char1', '角色1', '40001', '道具', '3', ''],
+        ['', '', '', '', '', '', '', ''],
+        ['2025-01-01', '1', 'char3', '角色3', '40003', '道具', '5', ''],
+    )
+    records, row_numbers, rejected, blank_rows = RowParser(HEADERS, 'sheet', 0).parse(rows)
+
+    assert row_numbers == [2, 4]
+    assert [record['char_id'] for record in records] == ['char1', 'char3']
+    assert rejected == []
+    assert blank_rows == [3]
+
+def test_row_with_missing_required_field_is_rejected():
+    """缺少角色身分證、道具編號或數量的資料列被拒絕，並記錄原因"""
+    rows = make_rows(
+        ['2025-01-01', '1', '', '角色1', '40001', '道具', '3', ''],
+        ['2025-01-01', '1', 'char2', '角色2', ' ', '道具', '3', ''],
+        ['2025-01-01', '1', 'char3', '角色3', '40003', '道具', '', ''],
+        ['2025-01-01', '1', 'char4', '角色4', '40004', '道具', '1,000', ''],
+    )
+    records, row_numbers, rejected, blank_rows = RowParser(HEADERS, 'sheet', 0).parse(rows)
+
+    assert row_numbers == [5]
+    assert records[0]['item_count'] == 1000
+    assert rejected == [
+        {'row_number': 2, 'reason': '缺少角色身分證'},
+        {'row_number': 3, 'reason': '缺少道具編號'},
+        {'row_number': 4, 'reason': '缺少數量'},
+    ]
+    assert blank_rows == []
@@ -0,0 +1,224 @@
+"""
+Google Sheets API 流量錄製與重播
+
+錄製（record）：在 GoogleSheetsService 使用的已授權 session 上攔截 request，
+將每次 HTTP 往返（方法、網址、請求內容、回應狀態與內容、耗時）逐行寫入 JSONL 檔案；
+網址中的 access_token/key 參數與回應中的令牌欄位會被移除，不會記錄任何請求標頭。
+
+重播（replay）：在本機啟動替身伺服器提供錄製的回應，session 的請求網址改寫為指向替身伺服器，
+不需要網路與 Google 帳號。回應延遲可依原始耗時（speed=1）、加速（speed>1）或不延遲（speed=0）。
+相同的請求依錄製順序回應，用完後重複最後一個回應。
+
+設定（環境變數）：
+    SHEETS_TRAFFIC_MODE=record|replay
+    SHEETS_TRAFFIC_FILE=config/sheets_traffic.jsonl
+    SHEETS_REPLAY_SPEED=1
+"""
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 不記錄的查詢參數與回應欄位
+SECRET_PARAMS = {'access_token', 'key', 'oauth_token'}
+SECRET_FIELDS = {'access_token', 'refresh_token', 'id_token', 'client_secret'}
+
+def request_key(method, host_path, query, body):
+    """請求的比對鍵值：方法、主機與路徑、排序後的查詢參數、正規化的請求內容"""
+    params = sorted((name, value) for name, value in parse_qsl(query, keep_blank_values=True) if name not in SECRET_PARAMS)
+    return '{} {}?{} {}'.format(method.upper(), host_path, urlencode(params), _normalize_body(body))
+
+def _normalize_body(body):
+    if not body:
+        return ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        return body
+
+def _redact(text):
+    """移除回應內容中的令牌欄位（JSON 以外的內容原樣保留）"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(data, dict) and SECRET_FIELDS.intersection(data):
+        data = {name: ('<redacted>' if name in SECRET_FIELDS else value) for name, value in data.items()}
+        return json.dumps(data, ensure_ascii=False)
+    return text
+
+def _client_session(client):
+    """gspread client 使用的 session（gspread 6 位於 client.http_client，較舊版本位於 client）"""
+    return getattr(client, 'http_client', client).session
+
+class TrafficRecorder:
+    """將 session 的每次 HTTP 往返寫入 JSONL 檔案"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+    
+    def wrap(self, request):
+        def recorded_request(method, url, *args, **kwargs):
+            started = time.perf_counter()
+            response = request(method, url, *args, **kwargs)
+            elapsed = time.perf_counter() - started
+            self.record(method, response, elapsed)
+            return response
+        return recorded_request
+    
+    def record(self, method, response, elapsed):
+        parts = urlsplit(response.request.url if response.request is not None else response.url)
+        host_path = parts.netloc + parts.path
+        body = response.request.body if response.request is not None else None
+        exchange = {
+            'key': request_key(method, host_path, parts.query, body),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', 'application/json; charset=UTF-8'),
+            'elapsed': round(elapsed, 6),
+            'response': _redact(response.text)
+        }
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(exchange, ensure_ascii=False) + '\n')
+
+class ReplayServer:
+    """以錄製檔案回應請求的本機替身伺服器（背景執行緒）"""
+    
+    def __init__(self, path, speed=1.0):
+        from http.server import ThreadingHTTPServer
+        self.speed = speed
+        self.lock = threading.Lock()
+        # 比對鍵值 -> 錄製的回應（依順序）；served 記錄每個鍵值已回應的次數
+        self.exchanges = {}
+        self.served = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self.exchanges.setdefault(exchange['key'], []).append(exchange)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, name='sheets-replay', daemon=True).start()
+        logger.info(f"Sheets API 重播伺服器已啟動: {self.base_url}（{sum(map(len, self.exchanges.values()))} 筆錄製資料）")
+    
+    def lookup(self, key):
+        """取得下一個錄製回應，找不到時回傳 None"""
+        with self.lock:
+            exchanges = self.exchanges.get(key)
+            if not exchanges:
+                return None
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+            return exchanges[min(index, len(exchanges) - 1)]
+    
+    def wrap(self, request):
+        """將請求網址改寫為替身伺服器（https://主機/路徑 -> http://127.0.0.1:port/主機/路徑）"""
+        def replayed_request(method, url, *args, **kwargs):
+            parts = urlsplit(url)
+            local_url = f'{self.base_url}/{parts.netloc}{parts.path}'
+            if parts.query:
+                local_url += '?' + parts.query
+            return request(method, local_url, *args, **kwargs)
+        return replayed_request
+    
+    def shutdown(self):
+        self.server.shutdown()
+    
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+        replay = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                parts = urlsplit(self.path)
+                key = request_key(self.command, parts.path.lstrip('/'), parts.query, body)
+                exchange = replay.lookup(key)
+                if exchange is None:
+                    logger.warning(f"重播資料中沒有對應的請求: {key[:200]}")
+                    payload = json.dumps({'error': {'code': 404, 'message': f'not recorded: {key}', 'status': 'NOT_FOUND'}})
+                    status, content_type = 404, 'application/json; charset=UTF-8'
+                else:
+                    if replay.speed > 0:
+                        time.sleep(exchange['elapsed'] / replay.speed)
+                    payload = exchange['response']
+                    status, content_type = exchange['status'], exchange['content_type']
+                data = payload.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+
+class SheetsTraffic:
+    """依設定決定是否錄製或重播（GoogleSheetsService 在建立 session 後呼叫 attach）"""
+    
+    def __init__(self):
+        self.mode = ''
+        self.path = None
+        self.speed = 1.0
+        self.recorder = None
+        self.replay = None
+        self.lock = threading.Lock()
+        self._anonymous = None
+    
+    def configure(self, mode, path, speed):
+        """
+        依設定切換模式（'' 不攔截、'record' 錄製、'replay' 重播）
+        
+        Returns:
+            bool: 設定是否有變更（有變更時已建立的 session 需要重新建立）
+        """
+        with self.lock:
+            mode = (mode or '').lower()
+            if (mode, path, speed) == (self.mode, self.path, self.speed):
+                return False
+            if self.replay is not None:
+                self.replay.shutdown()
+            self.recorder = TrafficRecorder(path) if mode == 'record' else None
+            self.replay = ReplayServer(path, speed) if mode == 'replay' else None
+            self.mode, self.path, self.speed = mode, path, speed
+            logger.info(f"Sheets API 流量模式: {mode or '停用'}")
+            return True
+    
+    @property
+    def replaying(self):
+        return self.replay is not None
+    
+    def credentials(self):
+        """重播時使用的匿名憑證（不需要 token.json，也不會送出授權標頭）"""
+        if self._anonymous is None:
+            from google.auth.credentials import AnonymousCredentials
+            self._anonymous = AnonymousCredentials()
+        return self._anonymous
+    
+    def attach(self, client):
+        """攔截 gspread client 的 session"""
+        self.attach_session(_client_session(client))
+        return client
+    
+    def attach_session(self, session):
+        """攔截已授權的 session"""
+        handler = self.recorder or self.replay
+        if handler is not None and not getattr(session, '_sheets_traffic', False):
+            session.request = handler.wrap(session.request)
+            session._sheets_traffic = True
+        return session
+
+# 程序層級的錄製/重播設定（由 GoogleSheetsService 依設定檔設定）
+sheets_traffic = SheetsTraffic()